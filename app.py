@@ -1,14 +1,62 @@
 import streamlit as st
-import ollama
+import ollama_client
+from response_cache import replay_chunks
+from context_manager import ContextManager, is_summary, latest_summary
 import json
 import base64
 import os
-from history_manager import HistoryManager
+import threading
+import time
+import uuid
+from sqlite_history import SQLiteHistoryManager
 from streamlit_mic_recorder import mic_recorder, speech_to_text
 from rag_engine import RAGEngine
+from titling import TitleService
+
+# Sessions untouched this long are compressed into cold storage at startup
+ARCHIVE_AFTER_DAYS = 30
+HISTORY_PAGE_SIZE = 30
+# Ollama options for chat replies. With {"temperature": 0} replies are deterministic and repeated
+# questions are answered from the response cache
+REPLY_OPTIONS = {}
+# Messages rendered when a session is opened; "Load older messages" fetches pages of this size
+MESSAGE_PAGE_SIZE = 40
 
 # Initialize History Manager
-history_mgr = HistoryManager()
+@st.cache_resource
+def get_history_manager():
+    mgr = SQLiteHistoryManager(archive_after=ARCHIVE_AFTER_DAYS * 86400)
+    mgr.import_json_sessions()
+    return mgr
+
+history_mgr = get_history_manager()
+
+# Replies streaming and the session each browser tab has open, shared by all tabs of this server
+@st.cache_resource
+def get_ui_activity():
+    return {"lock": threading.Lock(), "streaming": 0, "open": {}}
+
+ui_activity = get_ui_activity()
+
+def no_reply_streaming():
+    with ui_activity["lock"]:
+        return ui_activity["streaming"] == 0
+
+def open_sessions():
+    # Tabs that have not rerun for an hour are treated as closed
+    cutoff = time.time() - 3600
+    with ui_activity["lock"]:
+        return {s_id for s_id, seen in ui_activity["open"].values() if seen > cutoff}
+
+# Titles sessions idle for a couple of minutes in background batches with a small model, while no reply
+# is streaming, leaving the sessions open in a tab alone
+@st.cache_resource
+def get_title_service():
+    service = TitleService(history_mgr)
+    service.start(is_idle=no_reply_streaming, exclude=open_sessions)
+    return service
+
+title_service = get_title_service()
 
 # Initialize RAG Engine
 @st.cache_resource
@@ -17,6 +65,11 @@ def get_rag_engine():
 
 rag_engine = get_rag_engine()
 
+# Load a model (and the embedder) in the background the first time it is selected
+@st.cache_resource
+def warm_up_model(model):
+    return ollama_client.warm_up([model])
+
 # Page configuration
 st.set_page_config(page_title="Ollama", page_icon="🌌", layout="wide")
 
@@ -274,11 +327,21 @@ def copy_text(text):
 # INITIALIZE STATE
 # ---------------------------------------------------------
 if "messages" not in st.session_state: st.session_state.messages = []
+# Session index of st.session_state.messages[0]; long sessions are loaded a page at a time
+if "messages_start" not in st.session_state: st.session_state.messages_start = 0
+# Newest conversation summary when it lies before the loaded window
+if "session_summary" not in st.session_state: st.session_state.session_summary = None
 if "session_id" not in st.session_state: st.session_state.session_id = history_mgr.generate_session_id()
+# The open session may have been titled (renamed) by a background batch
+st.session_state.session_id = title_service.resolve(st.session_state.session_id)
+if "tab_id" not in st.session_state: st.session_state.tab_id = uuid.uuid4().hex
+with ui_activity["lock"]:
+    ui_activity["open"][st.session_state.tab_id] = (st.session_state.session_id, time.time())
 if "voice_text" not in st.session_state: st.session_state.voice_text = ""
 if "speaking_idx" not in st.session_state: st.session_state.speaking_idx = -1
 if "text_to_speak" not in st.session_state: st.session_state.text_to_speak = None
 if "rag_enabled" not in st.session_state: st.session_state.rag_enabled = False
+if "history_limit" not in st.session_state: st.session_state.history_limit = HISTORY_PAGE_SIZE
 
 # Sidebar Content
 with st.sidebar:
@@ -286,6 +349,8 @@ with st.sidebar:
     
     if st.button("✨ New Conversation", use_container_width=True, type="primary"):
         st.session_state.messages = []
+        st.session_state.messages_start = 0
+        st.session_state.session_summary = None
         st.session_state.session_id = history_mgr.generate_session_id()
         st.session_state.voice_text = ""
         st.session_state.speaking_idx = -1
@@ -293,11 +358,34 @@ with st.sidebar:
 
     st.markdown("<p style='color: var(--text-dim); font-size: 0.8rem; margin-top: 2rem; margin-bottom: 0.5rem; font-weight: 600;'>HISTORY</p>", unsafe_allow_html=True)
     
+    search_query = st.text_input("Search chats", placeholder="🔍 Search chats...", label_visibility="collapsed")
+    if search_query.strip():
+        try:
+            search_results = history_mgr.search(search_query, limit=20)
+        except Exception:
+            search_results = []
+        if not search_results:
+            st.caption("No matches.")
+        for i, r in enumerate(search_results):
+            s_id = r['session_id']
+            if st.button(f"🔎 {r['snippet'][:60]}", key=f"sr_{i}_{s_id}", help=s_id, use_container_width=True):
+                st.session_state.messages, st.session_state.messages_start = history_mgr.load_session_window(s_id, MESSAGE_PAGE_SIZE)
+                st.session_state.session_summary = None
+                if st.session_state.messages_start > 0 and latest_summary(st.session_state.messages) is None:
+                    st.session_state.session_summary = history_mgr.load_latest_summary(s_id)
+                st.session_state.session_id = s_id
+                st.session_state.voice_text = ""
+                st.rerun()
+        st.divider()
+
     # Load and display sessions
     try:
-        current_sessions = history_mgr.list_sessions()
+        # Fetch one extra row to know whether a "Show more" button is needed
+        current_sessions = history_mgr.list_sessions(limit=st.session_state.history_limit + 1)
     except Exception:
         current_sessions = []
+    has_more = len(current_sessions) > st.session_state.history_limit
+    current_sessions = current_sessions[:st.session_state.history_limit]
 
     for s in current_sessions:
         s_id = s['id']
@@ -305,7 +393,10 @@ with st.sidebar:
         with col_n:
             label = s_id[:15] + "..." if len(s_id) > 15 else s_id
             if st.button(f"💬 {label}", key=f"s_{s_id}", use_container_width=True):
-                st.session_state.messages = history_mgr.load_session(s_id)
+                st.session_state.messages, st.session_state.messages_start = history_mgr.load_session_window(s_id, MESSAGE_PAGE_SIZE)
+                st.session_state.session_summary = None
+                if st.session_state.messages_start > 0 and latest_summary(st.session_state.messages) is None:
+                    st.session_state.session_summary = history_mgr.load_latest_summary(s_id)
                 st.session_state.session_id = s_id
                 st.session_state.voice_text = ""
                 st.rerun()
@@ -314,26 +405,36 @@ with st.sidebar:
                 history_mgr.delete_session(s_id)
                 if st.session_state.session_id == s_id:
                     st.session_state.messages = []
+                    st.session_state.messages_start = 0
+                    st.session_state.session_summary = None
                     st.session_state.session_id = history_mgr.generate_session_id()
                 st.rerun()
 
+    if has_more and st.button("Show more", key="history_more", use_container_width=True):
+        st.session_state.history_limit += HISTORY_PAGE_SIZE
+        st.rerun()
+
     st.divider()
     
     # Model Selection
     try:
-        available_models = [m['name'] for m in ollama.list()['models']]
+        available_models = [m['name'] for m in ollama_client.list_models()['models']]
         if not available_models: available_models = ["llama3.2"]
     except:
         available_models = ["llama3.2"]
     
     selected_model = st.selectbox("🧠 Model", available_models, index=0)
+    warm_up_model(selected_model)
 
     # Export Feature
     if st.session_state.messages:
         st.markdown("<p style='color: var(--text-dim); font-size: 0.8rem; margin-top: 1rem; margin-bottom: 0.5rem; font-weight: 600;'>💾 EXPORT</p>", unsafe_allow_html=True)
         ex1, ex2 = st.columns(2)
-        js_data = json.dumps(st.session_state.messages, indent=2)
-        tx_data = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in st.session_state.messages])
+        export_messages = st.session_state.messages
+        if st.session_state.messages_start:
+            export_messages = history_mgr.load_session(st.session_state.session_id)
+        js_data = json.dumps(export_messages, indent=2)
+        tx_data = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in export_messages if not is_summary(m)])
         with ex1:
             st.download_button("JSON", js_data, file_name=f"chat_{st.session_state.session_id}.json", use_container_width=True)
         with ex2:
@@ -366,14 +467,14 @@ with st.sidebar:
                     temp_paths.append(temp_path)
                     st.write(f"Reading {uploaded_file.name}...")
 
-                num_splits = rag_engine.add_documents(temp_paths)
+                result = rag_engine.add_documents(temp_paths)
                 
                 # Cleanup temp files
                 for p in temp_paths:
                     if os.path.exists(p):
                         os.remove(p)
                 
-                status.update(label=f"Done! Created {num_splits} text chunks.", state="complete")
+                status.update(label=f"Done! Created {result['chunks']} text chunks ({result['cache_hits']} cached embeddings reused, {result['skipped_files']} unchanged files skipped).", state="complete")
                 st.toast(f"Knowledge Base updated with {len(uploaded_files)} files!")
 
     if rag_engine.has_knowledge():
@@ -412,7 +513,14 @@ st.markdown(f"<p style='color: var(--text-dim); margin-top: -1rem; font-size: 0.
 # Message Container
 chat_box = st.container()
 with chat_box:
+    if st.session_state.messages_start > 0 and st.button("⬆️ Load older messages", key="older_messages"):
+        older, st.session_state.messages_start = history_mgr.load_session_window(
+            st.session_state.session_id, MESSAGE_PAGE_SIZE, before=st.session_state.messages_start)
+        st.session_state.messages = older + st.session_state.messages
+        st.rerun()
     for i, msg in enumerate(st.session_state.messages):
+        if is_summary(msg):
+            continue
         role = msg["role"]
         with st.chat_message(role):
             st.markdown(msg["content"])
@@ -479,7 +587,8 @@ else:
 
 if prompt:
     st.session_state.messages.append({"role": "user", "content": prompt})
-    history_mgr.save_session(st.session_state.session_id, st.session_state.messages)
+    history_mgr.save_session(st.session_state.session_id, st.session_state.messages,
+                             start=st.session_state.messages_start)
     
     with chat_box:
         with st.chat_message("user"): st.markdown(prompt)
@@ -493,31 +602,73 @@ if prompt:
                 
                 # If RAG is enabled, get context
                 context_prefix = ""
-                if st.session_state.rag_enabled and rag_engine.has_knowledge():
+                use_rag = st.session_state.rag_enabled and rag_engine.has_knowledge()
+                kb_version = rag_engine.kb_version
+                # Only an opening question is self-contained enough to share an answer with another chat
+                semantic = use_rag and st.session_state.messages_start + len(st.session_state.messages) == 1
+                cached_answer = rag_engine.cached_answer(prompt, selected_model) if semantic else None
+                if use_rag and cached_answer is None:
                     with st.spinner("Searching knowledge base..."):
-                        context = rag_engine.query(prompt)
+                        context = rag_engine.retrieve_context(prompt, model=selected_model)
                         if context:
-                            context_str = "\n".join(context)
+                            context_str = "\n\n".join(context)
                             context_prefix = f"Using the following context from the knowledge base to answer the user's question:\n\n{context_str}\n\nUser Question: "
                 
-                # Prepare messages for Ollama (injecting context into the latest user message content)
-                ollama_messages = []
-                for m in st.session_state.messages[:-1]:
-                    ollama_messages.append(m)
+                # Prepare messages for Ollama: recent turns within the model's history budget, older ones as a summary
+                context_mgr = ContextManager(selected_model)
+                ollama_messages = context_mgr.build_messages(
+                    st.session_state.messages, st.session_state.messages_start, st.session_state.session_summary)
                 
                 # Update the last message with context for Ollama only
-                last_msg = st.session_state.messages[-1].copy()
+                last_msg = ollama_messages[-1].copy()
                 if context_prefix:
                     last_msg["content"] = context_prefix + last_msg["content"]
-                ollama_messages.append(last_msg)
-
-                for chunk in ollama.chat(model=selected_model, messages=ollama_messages, stream=True):
-                    full_resp += chunk['message']['content']
-                    thought.markdown(full_resp + "▌")
+                ollama_messages[-1] = last_msg
+
+                # Clicking Stop (or anything else) reruns the script mid-stream; the finally block closes the
+                # HTTP stream so Ollama stops generating, and keeps the partial answer
+                stop_slot = st.empty()
+                stop_slot.button("⏹ Stop", key="stop_generation")
+                if cached_answer is not None:
+                    chunks = replay_chunks(selected_model, cached_answer)
+                else:
+                    chunks = iter(ollama_client.ChatStream(selected_model, ollama_messages,
+                                                           options=REPLY_OPTIONS or None, cache=True))
+                completed = False
+                with ui_activity["lock"]:
+                    ui_activity["streaming"] += 1
+                try:
+                    for chunk in chunks:
+                        full_resp += chunk['message']['content']
+                        thought.markdown(full_resp + "▌")
+                    completed = True
+                finally:
+                    chunks.close()
+                    with ui_activity["lock"]:
+                        ui_activity["streaming"] -= 1
+                    if not completed and full_resp:
+                        st.session_state.messages.append({"role": "assistant", "content": full_resp})
+                        history_mgr.save_session(st.session_state.session_id, st.session_state.messages,
+                                                 start=st.session_state.messages_start)
+                stop_slot.empty()
                 thought.markdown(full_resp)
+                if semantic and cached_answer is None:
+                    rag_engine.store_answer(prompt, selected_model, full_resp, kb_version)
                 st.session_state.messages.append({"role": "assistant", "content": full_resp})
                 st.session_state.speaking_idx = -1
-                history_mgr.save_session(st.session_state.session_id, st.session_state.messages)
+                history_mgr.save_session(st.session_state.session_id, st.session_state.messages,
+                                         start=st.session_state.messages_start)
+                # Fold turns that fell out of the window into the stored summary (a no-op most turns)
+                try:
+                    summary = context_mgr.update_summary(
+                        st.session_state.messages, st.session_state.messages_start, st.session_state.session_summary)
+                except Exception as e:
+                    print(f"Summary error: {e}")
+                    summary = None
+                if summary:
+                    st.session_state.messages.append(summary)
+                    history_mgr.save_session(st.session_state.session_id, st.session_state.messages,
+                                             start=st.session_state.messages_start)
                 st.rerun()
             except Exception as e:
                 thought.error(f"Error: {e}")
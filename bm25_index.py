@@ -0,0 +1,123 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+# Keeps identifiers such as "ERR-4411", "v2.3.1" or "part_no_77" together as a single term
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+# Dropped from queries (not from the index): they match most chunks and add almost nothing to the ranking
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i if in into is it me my no not of on or our so "
+    "that the their them then there these they this to was we were what when where which who why will with "
+    "you your".split()
+)
+# Terms are never skipped for document frequency below this many chunks: short postings are cheap to score
+MIN_SKIPPED_DF = 1000
+
+
+def tokenize(text):
+    """Lowercased terms; compound identifiers are indexed whole and by their parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        parts = re.split(r"[-_.]", token)
+        if len(parts) > 1:
+            terms.extend(p for p in parts if p)
+    return terms
+
+
+class BM25Index:
+    """Local inverted index over knowledge base chunks, scored with Okapi BM25."""
+
+    def __init__(self, path, k1=1.5, b=0.75, max_df=0.2):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self._lock = threading.Lock()
+        self._corpus_stats = None
+        parent = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL, content TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_postings_term ON postings (term);"
+            "CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);"
+        )
+        self._conn.commit()
+
+    def add(self, ids, texts):
+        docs = []
+        postings = []
+        for doc_id, text in zip(ids, texts):
+            counts = Counter(tokenize(text))
+            docs.append((doc_id, sum(counts.values()), text))
+            postings.extend((term, doc_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO docs (id, length, content) VALUES (?, ?, ?)", docs)
+            self._conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)", postings)
+            self._conn.commit()
+            self._corpus_stats = None
+
+    def remove(self, ids):
+        rows = [(doc_id,) for doc_id in ids]
+        with self._lock:
+            self._conn.executemany("DELETE FROM postings WHERE doc_id = ?", rows)
+            self._conn.executemany("DELETE FROM docs WHERE id = ?", rows)
+            self._conn.commit()
+            self._corpus_stats = None
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+            self._corpus_stats = None
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM docs LIMIT 1").fetchone() is None
+
+    def search(self, query, k=10):
+        """Returns up to k (doc_id, score, content) tuples, best first. Stopwords, and terms found in more than
+        max_df of the chunks of a large index, are skipped; scoring runs inside SQLite."""
+        terms = set(tokenize(query))
+        terms = (terms - STOPWORDS) or terms
+        if not terms:
+            return []
+        with self._lock:
+            if self._corpus_stats is None:
+                count, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+                self._corpus_stats = (count, avg_length or 1.0)
+            num_docs, avg_length = self._corpus_stats
+            if not num_docs:
+                return []
+
+            weights = []
+            for term in terms:
+                df = self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+                if df:
+                    weights.append((df, term, math.log(1 + (num_docs - df + 0.5) / (df + 0.5))))
+            # A term in a large share of the chunks costs a scan of its whole postings list for almost no ranking signal;
+            # if only such terms are left the vector half of hybrid search does the ranking
+            max_df = max(self.max_df * num_docs, MIN_SKIPPED_DF)
+            weights = [w for w in weights if w[0] <= max_df]
+            if not weights:
+                return []
+
+            values = ", ".join("(?, ?)" for _ in weights)
+            params = [x for _, term, idf in weights for x in (term, idf)]
+            rows = self._conn.execute(
+                f"WITH q(term, idf) AS (VALUES {values}), "
+                "scored AS ("
+                "  SELECT p.doc_id, SUM(q.idf * p.tf * (? + 1) / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS score"
+                "  FROM q JOIN postings p ON p.term = q.term JOIN docs d ON d.id = p.doc_id"
+                "  GROUP BY p.doc_id ORDER BY score DESC LIMIT ?"
+                ") SELECT s.doc_id, s.score, d.content FROM scored s JOIN docs d ON d.id = s.doc_id ORDER BY s.score DESC",
+                params + [self.k1, self.k1, self.b, self.b, avg_length, k],
+            ).fetchall()
+        return [tuple(row) for row in rows]
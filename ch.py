@@ -1,7 +1,20 @@
-import ollama
+import ollama_client
+
+MODEL = "llama3.2"
+
+def reply(user_input, model=MODEL):
+    """One stateless question/answer round trip, as the chatbot loop makes it."""
+    response = ollama_client.chat(
+        model,
+        [
+            {"role": "user", "content": user_input}
+        ]
+    )
+    return response['message']['content']
 
 def chatbot():
     print("Local Ollama Chatbot (type 'quit' to exit)\n")
+    ollama_client.warm_up([MODEL], embedding_model=None)
 
     while True:
         user_input = input("You: ")
@@ -10,14 +23,7 @@ def chatbot():
             print("Goodbye ")
             break
 
-        response = ollama.chat(
-            model="llama3.2",   
-            messages=[
-                {"role": "user", "content": user_input}
-            ]
-        )
-
-        print("BOT:", response['message']['content'])
+        print("BOT:", reply(user_input))
 
 if __name__ == "__main__":
     chatbot()
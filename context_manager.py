@@ -0,0 +1,98 @@
+import ollama_client
+from token_counter import count_tokens, history_token_budget
+
+# Role markers and separators the chat template adds around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Longest slice of one message that goes into a summarisation prompt
+SUMMARY_MESSAGE_CHARS = 2000
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and an assistant.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{transcript}\n\n"
+    "Write the updated summary in at most 200 words. Keep names, facts, decisions and open questions; "
+    "drop small talk. Return ONLY the summary."
+)
+
+
+def is_summary(message):
+    return bool(message.get("summary"))
+
+
+def latest_summary(messages):
+    for message in reversed(messages):
+        if is_summary(message):
+            return message
+    return None
+
+
+class ContextManager:
+    """Builds the message list sent to the model for one turn: a rolling summary of older turns plus as
+    many recent turns as fit the model's history token budget, so prompt size stays flat as a chat grows.
+    Turns that overflow the budget are sent as they are until they are folded into the summary, which
+    happens once summary_batch of them have piled up.
+
+    Summaries are stored in the session like any other message, as
+    {"role": "system", "summary": True, "covers": n, "content": ...} where n is the session index up to
+    which messages are folded into it. Front ends skip them when drawing the chat.
+    """
+
+    def __init__(self, model, token_budget=None, summary_batch=6, summary_max_tokens=300, max_fold=40):
+        self.model = model
+        self.token_budget = token_budget or history_token_budget(model)
+        self.summary_batch = summary_batch
+        self.summary_max_tokens = summary_max_tokens
+        self.max_fold = max_fold
+
+    def _cost(self, message):
+        return count_tokens(message.get("content", ""), self.model) + MESSAGE_OVERHEAD_TOKENS
+
+    def _split(self, messages, start, summary):
+        """Splits the unsummarised turns into (older [(index, message)], recent [message]).
+        The newest turn is always kept, even when it alone exceeds the budget."""
+        covered = summary.get("covers", 0) if summary else 0
+        turns = [(index, m) for index, m in enumerate(messages, start) if index >= covered and not is_summary(m)]
+        budget = self.token_budget - (self._cost(summary) if summary else 0)
+        cut = len(turns)
+        used = 0
+        while cut > 0:
+            cost = self._cost(turns[cut - 1][1])
+            if used + cost > budget and cut < len(turns):
+                break
+            used += cost
+            cut -= 1
+        return turns[:cut], [m for _, m in turns[cut:]]
+
+    def build_messages(self, messages, start=0, summary=None):
+        """messages is the session, or a window of it beginning at session index start. summary is the
+        latest stored summary, for windows that do not contain it."""
+        summary = latest_summary(messages) or summary
+        older, recent = self._split(messages, start, summary)
+        # Turns past the budget that the summary does not cover yet are still sent verbatim, so none go
+        # missing while update_summary waits for summary_batch of them; max_fold bounds the overshoot
+        recent = [m for _, m in older[-self.max_fold:]] + recent
+        if summary:
+            return [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary['content']}"}] + recent
+        return recent
+
+    def update_summary(self, messages, start=0, summary=None):
+        """Folds turns that no longer fit the window into the summary once summary_batch of them have piled
+        up. Returns the new summary message to append to the session, or None. Calls the model when it does."""
+        summary = latest_summary(messages) or summary
+        older, _ = self._split(messages, start, summary)
+        if len(older) < self.summary_batch:
+            return None
+        older = older[:self.max_fold]
+        transcript = "\n".join(f"{m['role']}: {m.get('content', '')[:SUMMARY_MESSAGE_CHARS]}" for _, m in older)
+        prompt = SUMMARY_PROMPT.format(summary=summary["content"] if summary else "(none yet)", transcript=transcript)
+        response = ollama_client.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            options={"num_predict": self.summary_max_tokens, "temperature": 0.2},
+        )
+        return {
+            "role": "system",
+            "content": response["message"]["content"].strip(),
+            "summary": True,
+            "covers": older[-1][0] + 1,
+        }
@@ -1,13 +1,19 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
-import ollama
+import ollama_client
+from response_cache import replay_chunks
+from scheduler import GenerationScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from titling import TitleService
+from rag_prefetch import RAGPrefetcher
+from context_manager import ContextManager, is_summary, latest_summary
 import threading
+import asyncio
 import queue
 import time
 import os
 import speech_recognition as sr
-from history_manager import HistoryManager
+from sqlite_history import SQLiteHistoryManager
 from rag_engine import RAGEngine
 
 # Appearance Settings
@@ -21,6 +27,20 @@ BUBBLE_ASSISTANT = "#132244"
 BUBBLE_USER = "#00509D"
 ACCENT_PRIMARY = "#247BA0"
 
+# Sessions untouched this long are compressed into cold storage at startup
+ARCHIVE_AFTER_DAYS = 30
+HISTORY_PAGE_SIZE = 50
+# How often untitled sessions are titled in the background while no reply is queued or streaming
+TITLE_BATCH_INTERVAL_MS = 60 * 1000
+# Pause in typing after which knowledge base context is fetched speculatively, and the shortest text worth it
+PREFETCH_DEBOUNCE_MS = 300
+PREFETCH_MIN_CHARS = 12
+# Ollama options for chat replies. With {"temperature": 0} replies are deterministic and repeated
+# questions are answered from the response cache
+REPLY_OPTIONS = {}
+# Messages drawn when a session is opened; older ones are fetched in pages of this size on scroll-up
+MESSAGE_PAGE_SIZE = 40
+
 class ScrollableChatFrame(ctk.CTkScrollableFrame):
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
@@ -53,6 +73,15 @@ class ScrollableChatFrame(ctk.CTkScrollableFrame):
         self._parent_canvas.rowconfigure(len(self.messages), weight=1)
         return frame
 
+    def prepend_messages(self, messages):
+        """Draws older messages above the current ones."""
+        count = len(self.messages)
+        for msg in messages:
+            self.add_message(msg["role"], msg["content"], is_final=True)
+        self.messages = self.messages[count:] + self.messages[:count]
+        for row, frame in enumerate(self.messages):
+            frame.grid_configure(row=row)
+
     def update_stream(self, frame, content):
         frame._full_text = content
         if hasattr(frame, '_stream_label'):
@@ -138,11 +167,28 @@ class OllamaGUI(ctk.CTk):
         super().__init__()
 
         # --- Data & Settings ---
-        self.history_mgr = HistoryManager()
+        # Saves from the Tk main thread are queued and written by a background thread
+        self.history_mgr = SQLiteHistoryManager(write_behind=True, archive_after=ARCHIVE_AFTER_DAYS * 86400)
+        self.history_mgr.import_json_sessions()
+        self.history_limit = HISTORY_PAGE_SIZE
         self.rag_engine = RAGEngine()
+        self.prefetcher = RAGPrefetcher(self.rag_engine)
+        self._prefetch_job = None
         self.session_id = self.history_mgr.generate_session_id()
         self.messages = []
+        self.messages_start = 0
+        # Newest conversation summary when it lies before the loaded window
+        self.session_summary = None
         self.chat_queue = queue.Queue()
+        # All model calls go through one scheduler: replies before background jobs, one call per model at a
+        # time, and queued jobs for a chat the user has left are dropped
+        self.scheduler = GenerationScheduler(is_stale=lambda s_id: not self.is_current_session(s_id))
+        # Set to stop every reply queued or streaming; replaced after each stop
+        self.cancel_event = threading.Event()
+        self.title_service = TitleService(self.history_mgr)
+        # One background event loop serves all async RAG work instead of a thread per upload
+        self.async_loop = asyncio.new_event_loop()
+        threading.Thread(target=self.async_loop.run_forever, daemon=True).start()
         
         # --- UI Layout ---
         self.title("Ollama Desktop AI")
@@ -173,6 +219,8 @@ class OllamaGUI(ctk.CTk):
             "📄 Document QA (Llama 3.2 + RAG)": "llama3.2",
             "💻 Coding Mode (Llama 3.2)": "llama3.2"
         }
+        # Load the chat models and the embedder while the window comes up
+        ollama_client.warm_up(list(self.model_mapping.values()))
         
         self.model_option = ctk.CTkOptionMenu(
             self.sidebar, 
@@ -184,8 +232,15 @@ class OllamaGUI(ctk.CTk):
         self.model_option.grid(row=3, column=0, padx=20, pady=10)
 
         # History Area (inside sidebar)
-        self.history_label = ctk.CTkLabel(self.sidebar, text="Recents", font=ctk.CTkFont(size=14, weight="bold"), anchor="w")
-        self.history_label.grid(row=4, column=0, padx=20, pady=(15, 5), sticky="w")
+        self.history_header = ctk.CTkFrame(self.sidebar, fg_color="transparent")
+        self.history_header.grid(row=4, column=0, padx=10, pady=(15, 5), sticky="ew")
+
+        self.history_label = ctk.CTkLabel(self.history_header, text="Recents", font=ctk.CTkFont(size=14, weight="bold"), anchor="w")
+        self.history_label.pack(anchor="w", padx=10)
+
+        self.search_entry = ctk.CTkEntry(self.history_header, placeholder_text="🔍 Search chats...", height=30)
+        self.search_entry.pack(fill="x", padx=5, pady=(5, 0))
+        self.search_entry.bind("<Return>", lambda e: self.search_history())
         
         self.history_frame = ctk.CTkScrollableFrame(self.sidebar, fg_color="transparent")
         self.history_frame.grid(row=5, column=0, padx=10, pady=(0, 10), sticky="nsew")
@@ -219,15 +274,30 @@ class OllamaGUI(ctk.CTk):
         self.entry = ctk.CTkEntry(self.input_frame, placeholder_text="Type your message here...", height=45)
         self.entry.grid(row=0, column=0, sticky="ew", padx=(0, 10))
         self.entry.bind("<Return>", lambda e: self.send_message())
+        self.entry.bind("<KeyRelease>", self.schedule_prefetch)
 
         self.send_btn = ctk.CTkButton(self.input_frame, text="🚀", width=60, height=45, command=self.send_message, fg_color=ACCENT_PRIMARY)
         self.send_btn.grid(row=0, column=1, padx=(0, 5))
 
+        # Shown while a reply is streaming
+        self.stop_btn = ctk.CTkButton(self.input_frame, text="⏹", width=60, height=45, command=self.stop_generation, fg_color="#8B1E1E")
+        self.stop_btn.grid(row=0, column=3, padx=(5, 0))
+        self.stop_btn.grid_remove()
+
         self.voice_btn = ctk.CTkButton(self.input_frame, text="🎤", width=60, height=45, command=self.start_voice_thread, fg_color="#444444")
         self.voice_btn.grid(row=0, column=2)
 
         # --- Periodic Check for Messages ---
         self.check_queue()
+        self.after(TITLE_BATCH_INTERVAL_MS, self.title_idle_sessions)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        self.cancel_event.set()
+        self.title_service.stop()
+        self.scheduler.shutdown()
+        self.history_mgr.close()
+        self.destroy()
 
     def start_voice_thread(self):
         self.voice_btn.configure(text="🔴", fg_color="red")
@@ -270,9 +340,18 @@ class OllamaGUI(ctk.CTk):
         if "Document QA" in selected_mode:
             self.rag_switch.select()
 
+    def stop_generation(self):
+        """Stops queued and streaming replies; the stream's HTTP response is closed so Ollama stops generating."""
+        self.cancel_event.set()
+        self.cancel_event = threading.Event()
+        self.stop_btn.grid_remove()
+
     def new_chat(self):
+        self.stop_generation()
         self.session_id = self.history_mgr.generate_session_id()
         self.messages = []
+        self.messages_start = 0
+        self.session_summary = None
         for frame in self.chat_display.messages:
             frame.destroy()
         self.chat_display.messages = []
@@ -285,11 +364,13 @@ class OllamaGUI(ctk.CTk):
             widget.destroy()
         
         try:
-            sessions = self.history_mgr.list_sessions()
+            # Fetch one extra row to know whether a "Show more" button is needed
+            sessions = self.history_mgr.list_sessions(limit=self.history_limit + 1)
         except:
             sessions = []
+        has_more = len(sessions) > self.history_limit
             
-        for s in sessions:
+        for s in sessions[:self.history_limit]:
             s_id = s['id']
             display_text = s_id.split(" - ", 1)[1] if " - " in s_id else s_id
             btn = ctk.CTkButton(
@@ -305,9 +386,56 @@ class OllamaGUI(ctk.CTk):
             )
             btn.pack(fill="x", padx=5, pady=2)
 
+        if has_more:
+            more_btn = ctk.CTkButton(self.history_frame, text="Show more", fg_color="transparent", text_color="gray", hover_color="#1E293B", command=self.show_more_history)
+            more_btn.pack(fill="x", padx=5, pady=2)
+
+    def search_history(self):
+        query = self.search_entry.get().strip()
+        if not query:
+            self.refresh_history_ui()
+            return
+
+        for widget in self.history_frame.winfo_children():
+            widget.destroy()
+
+        try:
+            results = self.history_mgr.search(query, limit=30)
+        except Exception as e:
+            print(f"Search error: {e}")
+            results = []
+
+        if not results:
+            ctk.CTkLabel(self.history_frame, text="No matches.", text_color="gray").pack(pady=10)
+
+        for r in results:
+            s_id = r['session_id']
+            title = s_id.split(" - ", 1)[1] if " - " in s_id else s_id
+            btn = ctk.CTkButton(
+                self.history_frame,
+                text=f"{title[:30]}\n{r['snippet'][:60]}",
+                fg_color="transparent",
+                text_color="white",
+                hover_color="#1E293B",
+                anchor="w",
+                font=ctk.CTkFont(size=12),
+                corner_radius=8,
+                command=lambda id=s_id: self.load_session(id)
+            )
+            btn.pack(fill="x", padx=5, pady=2)
+
+    def show_more_history(self):
+        self.history_limit += HISTORY_PAGE_SIZE
+        self.refresh_history_ui()
+
     def load_session(self, s_id):
+        self.stop_generation()
         self.session_id = s_id
-        self.messages = self.history_mgr.load_session(s_id)
+        # Only the newest page is loaded; self.messages_start is the session index of self.messages[0]
+        self.messages, self.messages_start = self.history_mgr.load_session_window(s_id, MESSAGE_PAGE_SIZE)
+        self.session_summary = None
+        if self.messages_start > 0 and latest_summary(self.messages) is None:
+            self.session_summary = self.history_mgr.load_latest_summary(s_id)
         # Clear UI
         for frame in self.chat_display.messages:
             frame.destroy()
@@ -316,7 +444,28 @@ class OllamaGUI(ctk.CTk):
         self.current_response_text = ""
         # Redraw messages
         for msg in self.messages:
-            self.chat_display.add_message(msg["role"], msg["content"], is_final=True)
+            if not is_summary(msg):
+                self.chat_display.add_message(msg["role"], msg["content"], is_final=True)
+        self.after(50, lambda: self.chat_display._parent_canvas.yview_moveto(1.0))
+
+    def load_older_messages(self):
+        """Fetches the page of messages before the loaded window when the chat is scrolled to the top."""
+        if self.messages_start <= 0:
+            return
+        older, start = self.history_mgr.load_session_window(self.session_id, MESSAGE_PAGE_SIZE, before=self.messages_start)
+        if not older:
+            self.messages_start = 0
+            return
+        canvas = self.chat_display._parent_canvas
+        old_height = canvas.bbox("all")[3] if canvas.bbox("all") else 0
+        self.chat_display.prepend_messages([m for m in older if not is_summary(m)])
+        self.messages = older + self.messages
+        self.messages_start = start
+        self.update_idletasks()
+        new_height = canvas.bbox("all")[3] if canvas.bbox("all") else 0
+        if new_height:
+            # Keep the message that was at the top in place instead of jumping to the oldest one
+            canvas.yview_moveto((new_height - old_height) / new_height)
 
     def view_kb_files(self):
         files_dict = self.rag_engine.get_uploaded_files()
@@ -328,6 +477,10 @@ class OllamaGUI(ctk.CTk):
         
         lbl = ctk.CTkLabel(top, text="Files currently in Knowledge Base:", font=ctk.CTkFont(weight="bold"))
         lbl.pack(pady=10)
+
+        prefetch = self.prefetcher.stats()
+        ctk.CTkLabel(top, text=f"Context prefetch: {prefetch['exact_hits'] + prefetch['near_hits']}/{prefetch['lookups']} hits "
+                               f"({prefetch['hit_rate']:.0%}), {prefetch['saved_ms']:.0f} ms saved", text_color="gray").pack()
         
         if not files_dict:
             ctk.CTkLabel(top, text="No files found.").pack(pady=20)
@@ -356,14 +509,18 @@ class OllamaGUI(ctk.CTk):
         files = filedialog.askopenfilenames(title="Select Documents", filetypes=[("PDF/TXT", "*.pdf *.txt")])
         if files:
             self.upload_btn.configure(text="Processing...", state="disabled")
-            threading.Thread(target=self._process_docs, args=(files,), daemon=True).start()
+            future = asyncio.run_coroutine_threadsafe(self.rag_engine.aadd_documents(list(files)), self.async_loop)
+            future.add_done_callback(self._process_docs)
 
-    def _process_docs(self, files):
+    def _process_docs(self, future):
         try:
-            num = self.rag_engine.add_documents(files)
-            self.after(0, lambda: messagebox.showinfo("Done", f"Added {num} chunks to Knowledge Base!"))
+            result = future.result()
+            summary = f"Added {result['chunks']} chunks to Knowledge Base!\n({result['cache_hits']} embeddings reused from cache, {result['cache_misses']} computed)"
+            if result['skipped_files']:
+                summary += f"\n{result['skipped_files']} unchanged file(s) skipped."
+            self.after(0, lambda: messagebox.showinfo("Done", summary))
         except Exception as e:
-            self.after(0, lambda: messagebox.showerror("Error", str(e)))
+            self.after(0, lambda err=str(e): messagebox.showerror("Error", err))
         finally:
             self.after(0, lambda: self.upload_btn.configure(text="📥 Upload Docs", state="normal"))
 
@@ -372,49 +529,91 @@ class OllamaGUI(ctk.CTk):
             self.rag_engine.clear_database()
             messagebox.showinfo("Cleared", "Knowledge Base is now empty.")
 
+    def schedule_prefetch(self, event=None):
+        """Debounces typing; once it pauses, fetches context for the draft in the background."""
+        if self._prefetch_job is not None:
+            self.after_cancel(self._prefetch_job)
+            self._prefetch_job = None
+        if event is not None and event.keysym == "Return":
+            return
+        if self.rag_switch.get() and self.rag_engine.has_knowledge():
+            self._prefetch_job = self.after(PREFETCH_DEBOUNCE_MS, self._prefetch_draft)
+
+    def _prefetch_draft(self):
+        self._prefetch_job = None
+        draft = self.entry.get().strip()
+        if len(draft) >= PREFETCH_MIN_CHARS:
+            model = self.model_mapping.get(self.model_option.get(), "llama3.2")
+            self.prefetcher.prefetch(draft, model)
+
     def send_message(self):
         prompt = self.entry.get().strip()
         if not prompt: return
+        # The open session may have been titled (renamed) by a background batch
+        self.session_id = self.title_service.resolve(self.session_id)
         
         self.entry.delete(0, tk.END)
         self.chat_display.add_message("user", prompt, is_final=True)
         self.messages.append({"role": "user", "content": prompt})
-        self.history_mgr.save_session(self.session_id, self.messages)
+        self.history_mgr.save_session(self.session_id, self.messages, start=self.messages_start)
         
-        # Start AI thread
-        threading.Thread(target=self.ollama_thread, args=(prompt, self.session_id), daemon=True).start()
-
-    def ollama_thread(self, prompt, current_session_id):
+        # Queue the reply ahead of any background jobs
+        model = self.model_mapping.get(self.model_option.get(), "llama3.2")
+        cancel_event = self.cancel_event
+        # The job may wait behind another reply, so it gets the conversation as it is now
+        conversation = (list(self.messages), self.messages_start, self.session_summary, self.rag_switch.get())
+        self.scheduler.submit(
+            lambda s_id=self.session_id: self.ollama_thread(prompt, s_id, model, cancel_event, conversation),
+            model, PRIORITY_INTERACTIVE, session_id=self.session_id)
+
+    def ollama_thread(self, prompt, current_session_id, model, cancel_event, conversation):
+        messages, messages_start, session_summary, rag_enabled = conversation
         try:
-            mode_name = self.model_option.get()
-            model = self.model_mapping.get(mode_name, "llama3.2")
+            if cancel_event.is_set():
+                return
             
             # RAG Context
             context_prefix = ""
-            if self.rag_switch.get() and self.rag_engine.has_knowledge():
-                context = self.rag_engine.query(prompt)
+            use_rag = rag_enabled and self.rag_engine.has_knowledge()
+            kb_version = self.rag_engine.kb_version
+            # Only an opening question is self-contained enough to share an answer with another chat
+            semantic = use_rag and messages_start + len(messages) == 1
+            cached_answer = self.rag_engine.cached_answer(prompt, model) if semantic else None
+            if use_rag and cached_answer is None:
+                # Usually already fetched while the prompt was being typed
+                context = self.prefetcher.take(prompt, model)
+                if context is None:
+                    context = self.rag_engine.retrieve_context(prompt, model=model)
                 if context:
-                    context_str = "\n".join(context)
+                    context_str = "\n\n".join(context)
                     context_prefix = f"Context from Knowledge Base:\n{context_str}\n\nIMPORTANT: Answer the User Question based strictly on the Context above. If the context does not contain the answer or is completely irrelevant to the question, ignore the context completely and answer from your general knowledge.\n\nUser Question: "
 
-            # Prepare messages
-            ollama_msgs = []
-            for m in self.messages[:-1]:
-                ollama_msgs.append(m)
+            # Prepare messages: recent turns within the model's history budget, older ones as a summary
+            ollama_msgs = ContextManager(model).build_messages(messages, messages_start, session_summary)
             
-            last_msg = self.messages[-1].copy()
+            last_msg = ollama_msgs[-1].copy()
             if context_prefix:
                 last_msg["content"] = context_prefix + last_msg["content"]
-            ollama_msgs.append(last_msg)
+            ollama_msgs[-1] = last_msg
 
             full_response = ""
             self.chat_queue.put(("start", "", current_session_id))
             
-            for chunk in ollama.chat(model=model, messages=ollama_msgs, stream=True):
+            if cached_answer is not None:
+                stream = replay_chunks(model, cached_answer)
+            else:
+                stream = ollama_client.ChatStream(model, ollama_msgs, cancel_event,
+                                                 options=REPLY_OPTIONS or None, cache=True)
+            for chunk in stream:
+                if cancel_event.is_set():
+                    break
                 chunk_text = chunk['message']['content']
                 full_response += chunk_text
                 self.chat_queue.put(("chunk", chunk_text, current_session_id))
+            if semantic and cached_answer is None and not cancel_event.is_set():
+                self.rag_engine.store_answer(prompt, model, full_response, kb_version)
             
+            # A stopped reply is finalised with what was generated so far
             self.chat_queue.put(("final", full_response, current_session_id))
         except Exception as e:
             self.chat_queue.put(("error", str(e), current_session_id))
@@ -425,10 +624,13 @@ class OllamaGUI(ctk.CTk):
                 msg_type, content, msg_session_id = self.chat_queue.get_nowait()
                 
                 # Ignore messages from older chat sessions
-                if msg_session_id != self.session_id:
+                if not self.is_current_session(msg_session_id):
                     continue
+                # The open session may have been titled (renamed) since the job was queued
+                self.session_id = self.title_service.resolve(self.session_id)
                     
                 if msg_type == "start":
+                    self.stop_btn.grid()
                     self.current_response_frame = self.chat_display.add_message("assistant", "", is_final=False)
                     self.current_response_text = ""
                 elif msg_type == "chunk":
@@ -436,42 +638,82 @@ class OllamaGUI(ctk.CTk):
                     if getattr(self, "current_response_frame", None) and self.current_response_frame.winfo_exists():
                         self.chat_display.update_stream(self.current_response_frame, self.current_response_text)
                 elif msg_type == "final":
+                    self.stop_btn.grid_remove()
+                    if getattr(self, "current_response_frame", None) and not self.current_response_text:
+                        # Stopped before the first token
+                        self.current_response_frame.destroy()
+                        self.chat_display.messages.remove(self.current_response_frame)
+                        self.current_response_frame = None
                     if getattr(self, "current_response_frame", None) and self.current_response_frame.winfo_exists():
                         self.chat_display.finalize_stream(self.current_response_frame, "assistant", self.current_response_text)
                         self.messages.append({"role": "assistant", "content": self.current_response_text})
-                        self.history_mgr.save_session(self.session_id, self.messages)
+                        self.history_mgr.save_session(self.session_id, self.messages, start=self.messages_start)
                         self.current_response_frame = None
-                        if len(self.messages) == 2:
+                        if self.messages_start + len(self.messages) == 2:
                             self.auto_title_session()
+                        else:
+                            self.update_summary()
+                elif msg_type == "summary":
+                    self.messages.append(content)
+                    self.history_mgr.save_session(self.session_id, self.messages, start=self.messages_start)
                 elif msg_type == "error":
+                    self.stop_btn.grid_remove()
                     messagebox.showerror("Ollama Error", content)
         except queue.Empty:
             pass
         finally:
+            if self.messages_start > 0 and self.chat_display._parent_canvas.yview()[0] <= 0.0:
+                self.load_older_messages()
             self.after(100, self.check_queue)
 
+    def is_current_session(self, session_id):
+        """True if session_id is the open chat, also under the id it had before being titled."""
+        resolve = self.title_service.resolve
+        return resolve(session_id) == resolve(self.session_id)
+
+    def update_summary(self):
+        """Folds turns that fell out of the context window into the session summary, off the main thread."""
+        model = self.model_mapping.get(self.model_option.get(), "llama3.2")
+        messages, start, summary, session_id = list(self.messages), self.messages_start, self.session_summary, self.session_id
+
+        def _summarize():
+            try:
+                new_summary = ContextManager(model).update_summary(messages, start, summary)
+                if new_summary:
+                    self.chat_queue.put(("summary", new_summary, session_id))
+            except Exception as e:
+                print(f"Summary error: {e}")
+
+        self.scheduler.submit(_summarize, model, PRIORITY_BACKGROUND, session_id=session_id)
+
     def auto_title_session(self):
+        session_id = self.session_id
+
         def _generate_title():
             try:
-                mode_name = self.model_option.get()
-                model = self.model_mapping.get(mode_name, "llama3.2")
-                prompt = "Generate a short 3-5 word title for this chat based on the conversation so far. Return ONLY the title string, no quotes or extra text."
-                msgs = self.messages + [{"role": "user", "content": prompt}]
-                response = ollama.chat(model=model, messages=msgs)
-                title = response['message']['content'].strip(' "\'')
-                
-                valid_chars = "-_.() abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-                safe_title = ''.join(c for c in title if c in valid_chars)[:40]
-                
-                if safe_title:
-                    new_id = f"{self.session_id} - {safe_title}"
-                    self.history_mgr.rename_session(self.session_id, new_id)
-                    self.session_id = new_id
+                # Small title model, first exchange only
+                new_id = self.title_service.title_session(session_id)
+                if new_id:
+                    if self.session_id == session_id:
+                        self.session_id = new_id
                     self.after(0, self.refresh_history_ui)
             except Exception as e:
                 print(f"Auto-title error: {e}")
                 
-        threading.Thread(target=_generate_title, daemon=True).start()
+        self.scheduler.submit(_generate_title, self.title_service.model, PRIORITY_BACKGROUND, session_id=session_id)
+
+    def title_idle_sessions(self):
+        """Titles a batch of older untitled sessions when no reply is queued or streaming."""
+        stats = self.scheduler.stats()
+        if not stats["queued"] and not stats["running"]:
+            exclude = {self.session_id}
+
+            def _title_batch():
+                if self.title_service.run_batch(exclude):
+                    self.after(0, self.refresh_history_ui)
+
+            self.scheduler.submit(_title_batch, self.title_service.model, PRIORITY_BACKGROUND)
+        self.after(TITLE_BATCH_INTERVAL_MS, self.title_idle_sessions)
 
     def toggle_tts(self, btn, text):
         if hasattr(self, 'current_tts_process') and self.current_tts_process.poll() is None:
@@ -1,55 +1,400 @@
+import atexit
 import json
 import os
+import sqlite3
+import threading
+import time
 from datetime import datetime
+from history_search import HistorySearchIndex
+from session_archive import SessionArchive
+
+# Journal record that truncates the session to its first n messages (written when a list shrinks)
+TRUNCATE_KEY = "__truncate__"
 
 class HistoryManager:
-    def __init__(self, history_dir="chat_history"):
+    def __init__(self, history_dir="chat_history", storage="json", fsync=False, compact_threshold=64 * 1024,
+                 search=True, write_behind=False, flush_interval=1.0, archive_after=None):
+        """storage="json" rewrites one pretty-printed file per save; storage="journal" appends each new
+        message to a per-session JSONL journal, optionally fsync'ed, and compacts it in the background
+        once it passes compact_threshold bytes and contains superseded records.
+        search=True keeps a full-text index of message contents, updated incrementally on save.
+        write_behind=True hands saves to a background writer that coalesces repeated saves of a session
+        and flushes every flush_interval seconds and on close(), so a crash loses at most that interval.
+        archive_after (seconds) moves sessions untouched for that long into compressed cold storage in the
+        background at startup; archived sessions stay listed and are decompressed when opened."""
+        if storage not in ("json", "journal"):
+            raise ValueError(f"Unknown history storage: {storage}")
         self.history_dir = history_dir
+        self.storage = storage
+        self.fsync = fsync
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._journal_state = {}  # session_id -> [live messages, records in file]
         if not os.path.exists(self.history_dir):
             os.makedirs(self.history_dir)
 
-    def save_session(self, session_id, messages):
-        """Saves session messages to a JSON file."""
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._pending = {}  # session_id -> (start, latest unsaved messages)
+        self._pending_cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+
+        self.archive_after = archive_after
+        self.archive = self._open_archive()
+
+        self.search_index = self._open_search_index() if search else None
+        if self.search_index and not self.search_index.is_built():
+            threading.Thread(target=self._build_search_index, daemon=True).start()
+
+        if write_behind:
+            threading.Thread(target=self._writer_loop, daemon=True).start()
+            atexit.register(self.close)
+
+        if archive_after is not None:
+            threading.Thread(target=self.archive_old_sessions, daemon=True).start()
+
+    def _writer_loop(self):
+        while True:
+            with self._pending_cond:
+                self._pending_cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Writes every pending save now. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._pending_cond:
+                pending, self._pending = self._pending, {}
+            for session_id, (start, messages) in pending.items():
+                try:
+                    self._persist(session_id, messages, start)
+                except Exception as e:
+                    print(f"Error saving session {session_id}: {e}")
+
+    def close(self):
+        """Stops the background writer after flushing pending saves."""
+        with self._pending_cond:
+            self._closed = True
+            self._pending_cond.notify_all()
+        self.flush()
+
+    def _open_archive(self):
+        return SessionArchive(self.history_dir)
+
+    def archive_old_sessions(self, max_age=None):
+        """Moves sessions not modified for max_age seconds (default: archive_after) into cold storage.
+        Returns the number of sessions archived."""
+        max_age = self.archive_after if max_age is None else max_age
+        if max_age is None:
+            return 0
+        self.flush()
+        archived = 0
+        for session_id, mtime in self._archive_candidates(time.time() - max_age):
+            with self._flush_lock:
+                try:
+                    self._archive_session(session_id, mtime)
+                    archived += 1
+                except Exception as e:
+                    print(f"Error archiving session {session_id}: {e}")
+        return archived
+
+    def _archive_candidates(self, cutoff):
+        return [(session["id"], session["time"]) for session in self._list_live_sessions() if session["time"] < cutoff]
+
+    def _archive_session(self, session_id, mtime):
+        with self._lock:
+            self.archive.add(session_id, self._read_session(session_id), mtime)
+            self._delete_live_files(session_id)
+
+    def _restore_archived(self, session_id):
+        """Moves an archived session back to live storage before it is written to."""
+        with self._lock:
+            messages = self.archive.read(session_id)
+            if messages is None:
+                return
+            if self.storage == "journal":
+                self._rewrite_journal(session_id, messages)
+            else:
+                with open(self._json_path(session_id), "w", encoding="utf-8") as f:
+                    json.dump(messages, f, ensure_ascii=False, indent=2)
+            self.archive.remove(session_id)
+
+    def _open_search_index(self):
+        conn = sqlite3.connect(os.path.join(self.history_dir, "search_index.sqlite3"), check_same_thread=False)
+        return HistorySearchIndex(conn)
+
+    def _build_search_index(self):
+        """One-time indexing of sessions saved before the search index existed."""
+        try:
+            for session in self.list_sessions():
+                self._index_session(session["id"], self.load_session(session["id"]))
+            self.search_index.mark_built()
+        except Exception as e:
+            print(f"Error building search index: {e}")
+
+    def _index_session(self, session_id, messages, start=0):
+        if self.search_index:
+            try:
+                self.search_index.update(session_id, messages, start)
+            except Exception as e:
+                print(f"Error indexing session {session_id}: {e}")
+
+    def search(self, query, limit=20):
+        """Full-text search over message contents. Returns [{"session_id", "position", "snippet"}]."""
+        if not self.search_index:
+            return []
+        return self.search_index.search(query, limit)
+
+    def _json_path(self, session_id):
+        return os.path.join(self.history_dir, f"{session_id}.json")
+
+    def _journal_path(self, session_id):
+        return os.path.join(self.history_dir, f"{session_id}.jsonl")
+
+    def save_session(self, session_id, messages, start=0):
+        """Saves session messages to a JSON file, or appends the new ones to its journal.
+        Callers holding only a window of a long session pass the index of messages[0] as start."""
         if not session_id:
             return
-        filepath = os.path.join(self.history_dir, f"{session_id}.json")
+        if self.write_behind and not self._closed:
+            with self._pending_cond:
+                previous = self._pending.get(session_id)
+                if previous and previous[0] < start <= previous[0] + len(previous[1]):
+                    # Keep the older window's head so the coalesced save still covers it
+                    messages = previous[1][:start - previous[0]] + list(messages)
+                    start = previous[0]
+                elif previous and start > previous[0]:
+                    self._pending_cond.release()
+                    try:
+                        self.flush()
+                    finally:
+                        self._pending_cond.acquire()
+                # Later saves of the same session replace earlier ones, so a burst costs one write
+                self._pending[session_id] = (start, [dict(m) for m in messages])
+            return
+        self._persist(session_id, messages, start)
+
+    def _persist(self, session_id, messages, start=0):
+        self._write_session(session_id, messages, start)
+        self._index_session(session_id, messages, start)
+
+    def _write_session(self, session_id, messages, start=0):
+        if session_id in self.archive:
+            self._restore_archived(session_id)
+        if self.storage == "journal":
+            self._append_journal(session_id, messages, start)
+            return
+        if start:
+            messages = self._read_session(session_id)[:start] + list(messages)
+        filepath = self._json_path(session_id)
         with open(filepath, "w", encoding="utf-8") as f:
             json.dump(messages, f, ensure_ascii=False, indent=2)
 
+    def _append_journal(self, session_id, messages, start=0):
+        """Appends messages beyond those already journaled. Stored messages are treated as immutable;
+        a shorter list than what is on disk is recorded as a truncation."""
+        with self._lock:
+            path = self._journal_path(session_id)
+            if session_id not in self._journal_state:
+                legacy = self._json_path(session_id)
+                if not os.path.exists(path) and os.path.exists(legacy):
+                    # First journaled save of a session written by the JSON storage: convert it
+                    self._rewrite_journal(session_id, self._read_json(legacy))
+                    os.remove(legacy)
+                else:
+                    self._journal_state[session_id] = self._scan_journal(path)
+            live, records = self._journal_state[session_id]
+
+            end = start + len(messages)
+            lines = []
+            if end < live:
+                lines.append(json.dumps({TRUNCATE_KEY: end}))
+                live = end
+            lines.extend(json.dumps(m, ensure_ascii=False) for m in messages[max(live - start, 0):])
+            if not lines:
+                return
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            records += len(lines)
+            live = end
+            self._journal_state[session_id] = [live, records]
+
+        if records > live and os.path.getsize(path) > self.compact_threshold:
+            threading.Thread(target=self._compact_journal, args=(session_id,), daemon=True).start()
+
+    def _scan_journal(self, path):
+        if not os.path.exists(path):
+            return [0, 0]
+        with open(path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # Drop a record torn by a crash mid-append so the next append starts on a clean line
+                    f.seek(0)
+                    data = f.read()
+                    f.truncate(data.rfind(b"\n") + 1)
+        messages, records = self._replay_journal(path)
+        return [len(messages), records]
+
+    def _replay_journal(self, path):
+        messages = []
+        records = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-append; everything before it is intact
+                    continue
+                records += 1
+                if TRUNCATE_KEY in record:
+                    del messages[record[TRUNCATE_KEY]:]
+                else:
+                    messages.append(record)
+        return messages, records
+
+    def _rewrite_journal(self, session_id, messages):
+        path = self._journal_path(session_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for m in messages:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._journal_state[session_id] = [len(messages), len(messages)]
+
+    def _compact_journal(self, session_id):
+        """Rewrites a journal as one record per live message."""
+        with self._lock:
+            path = self._journal_path(session_id)
+            if not os.path.exists(path):
+                return
+            try:
+                messages, _ = self._replay_journal(path)
+                self._rewrite_journal(session_id, messages)
+            except Exception as e:
+                print(f"Error compacting journal {session_id}: {e}")
+
+    def _read_json(self, filepath):
+        with open(filepath, "r", encoding="utf-8") as f:
+            return json.load(f)
+
     def load_session(self, session_id):
-        """Loads session messages from a JSON file."""
-        filepath = os.path.join(self.history_dir, f"{session_id}.json")
+        """Loads session messages from its journal or JSON file."""
+        with self._pending_cond:
+            pending = self._pending.get(session_id)
+        if pending:
+            start, messages = pending
+            head = self._read_session(session_id)[:start] if start else []
+            return head + [dict(m) for m in messages]
+        return self._read_session(session_id)
+
+    def load_session_window(self, session_id, limit=50, before=None):
+        """Loads at most `limit` messages ending just before index `before` (default: the newest).
+        Returns (messages, start) where start is the index of the first one; start == 0 means nothing older."""
+        if session_id in self._pending:
+            messages = self.load_session(session_id)
+            end = len(messages) if before is None else min(before, len(messages))
+            start = max(0, end - limit)
+            return messages[start:end], start
+        return self._read_session_window(session_id, limit, before)
+
+    def _read_session_window(self, session_id, limit, before):
+        messages = self._read_session(session_id)
+        end = len(messages) if before is None else min(before, len(messages))
+        start = max(0, end - limit)
+        return messages[start:end], start
+
+    def load_latest_summary(self, session_id):
+        """Returns the newest conversation summary message stored in the session, or None."""
+        for message in reversed(self.load_session(session_id)):
+            if message.get("summary"):
+                return message
+        return None
+
+    def _read_session(self, session_id):
+        with self._lock:
+            journal = self._journal_path(session_id)
+            if os.path.exists(journal):
+                messages, _ = self._replay_journal(journal)
+                return messages
+        filepath = self._json_path(session_id)
         if os.path.exists(filepath):
-            with open(filepath, "r", encoding="utf-8") as f:
-                return json.load(f)
-        return []
+            return self._read_json(filepath)
+        return self.archive.read(session_id) or []
+
+    def list_sessions(self, limit=None, offset=0):
+        """Lists available sessions, sorted by modification time (newest first). limit/offset paginate."""
+        if self._pending:
+            self.flush()
+        return self._list_sessions(limit, offset)
+
+    def _list_sessions(self, limit, offset):
+        sessions = self._list_live_sessions() + self.archive.list()
+        sessions.sort(key=lambda x: x["time"], reverse=True)
+        return sessions[offset:offset + limit if limit is not None else None]
 
-    def list_sessions(self):
-        """Lists all available sessions, sorted by modification time (newest first)."""
-        files = [f for f in os.listdir(self.history_dir) if f.endswith(".json")]
+    def _list_live_sessions(self):
+        files = [f for f in os.listdir(self.history_dir) if f.endswith(".json") or f.endswith(".jsonl")]
         sessions = []
         for f in files:
             path = os.path.join(self.history_dir, f)
             mtime = os.path.getmtime(path)
             sessions.append({
-                "id": f.replace(".json", ""),
+                "id": f.rsplit(".", 1)[0],
                 "time": mtime
             })
-        sessions.sort(key=lambda x: x["time"], reverse=True)
         return sessions
 
     def delete_session(self, session_id):
         """Deletes a session file."""
-        filepath = os.path.join(self.history_dir, f"{session_id}.json")
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        with self._pending_cond:
+            self._pending.pop(session_id, None)
+        with self._flush_lock:
+            self._delete_session(session_id)
+            if self.search_index:
+                self.search_index.delete(session_id)
+
+    def _delete_session(self, session_id):
+        with self._lock:
+            self._delete_live_files(session_id)
+            self.archive.remove(session_id)
+
+    def _delete_live_files(self, session_id):
+        self._journal_state.pop(session_id, None)
+        for filepath in (self._json_path(session_id), self._journal_path(session_id)):
+            if os.path.exists(filepath):
+                os.remove(filepath)
 
     def rename_session(self, old_id, new_id):
         """Renames a session file."""
-        old_path = os.path.join(self.history_dir, f"{old_id}.json")
-        new_path = os.path.join(self.history_dir, f"{new_id}.json")
-        if os.path.exists(old_path):
-            os.rename(old_path, new_path)
+        self.flush()
+        with self._flush_lock:
+            self._rename_session(old_id, new_id)
+            if self.search_index:
+                self.search_index.rename(old_id, new_id)
+
+    def _rename_session(self, old_id, new_id):
+        with self._lock:
+            if old_id in self._journal_state:
+                self._journal_state[new_id] = self._journal_state.pop(old_id)
+            for old_path, new_path in ((self._json_path(old_id), self._json_path(new_id)),
+                                       (self._journal_path(old_id), self._journal_path(new_id))):
+                if os.path.exists(old_path):
+                    os.rename(old_path, new_path)
+            if old_id in self.archive:
+                self.archive.rename(old_id, new_id)
 
     def generate_session_id(self):
         """Generates a unique session ID based on timestamp."""
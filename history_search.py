@@ -0,0 +1,99 @@
+import re
+import threading
+
+class HistorySearchIndex:
+    """Incremental SQLite FTS5 index over chat message contents.
+
+    Each indexed message has a row in `entries` (session id and position, indexed by session) whose rowid
+    matches its row in the FTS table, so updates, renames and deletes touch only that session's rows.
+    """
+
+    def __init__(self, conn, lock=None):
+        self._conn = conn
+        self._lock = lock or threading.RLock()
+        with self._lock:
+            existing = self._conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+            ).fetchone()
+            if existing and "prefix" not in existing[0]:
+                # Indexes from before prefix indexing was added are rebuilt from the saved sessions
+                self._conn.executescript(
+                    "DROP TABLE messages_fts; DELETE FROM fts_entries; DELETE FROM fts_state WHERE key = 'built';"
+                )
+            self._conn.executescript(
+                # Prefix indexes on 2 and 3 characters keep search-as-you-type prefix queries cheap
+                "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, tokenize='unicode61', prefix='2 3');"
+                "CREATE TABLE IF NOT EXISTS fts_entries ("
+                "rowid INTEGER PRIMARY KEY, session_id TEXT NOT NULL, position INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS idx_fts_entries_session ON fts_entries (session_id, position);"
+                "CREATE TABLE IF NOT EXISTS fts_state (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            )
+            self._conn.commit()
+
+    def is_built(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM fts_state WHERE key = 'built'").fetchone() is not None
+
+    def mark_built(self):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO fts_state (key, value) VALUES ('built', '1')")
+            self._conn.commit()
+
+    def update(self, session_id, messages, start=0):
+        """Indexes messages not yet indexed for this session; drops rows past the end if the list shrank.
+        start is the session index of messages[0] when only a window is passed."""
+        end = start + len(messages)
+        with self._lock:
+            indexed = self._conn.execute(
+                "SELECT COUNT(*) FROM fts_entries WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            if end < indexed:
+                self._delete_rows(session_id, end)
+                indexed = end
+            for position in range(max(indexed, start), end):
+                cursor = self._conn.execute(
+                    "INSERT INTO fts_entries (session_id, position) VALUES (?, ?)", (session_id, position)
+                )
+                self._conn.execute(
+                    "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)",
+                    (cursor.lastrowid, messages[position - start].get("content", "")),
+                )
+            self._conn.commit()
+
+    def _delete_rows(self, session_id, from_position=0):
+        rowids = [row[0] for row in self._conn.execute(
+            "SELECT rowid FROM fts_entries WHERE session_id = ? AND position >= ?", (session_id, from_position)
+        )]
+        self._conn.executemany("DELETE FROM messages_fts WHERE rowid = ?", [(r,) for r in rowids])
+        self._conn.executemany("DELETE FROM fts_entries WHERE rowid = ?", [(r,) for r in rowids])
+
+    def delete(self, session_id):
+        with self._lock:
+            self._delete_rows(session_id)
+            self._conn.commit()
+
+    def rename(self, old_id, new_id):
+        with self._lock:
+            self._delete_rows(new_id)
+            self._conn.execute("UPDATE fts_entries SET session_id = ? WHERE session_id = ?", (new_id, old_id))
+            self._conn.commit()
+
+    def search(self, query, limit=20, window=500):
+        """Returns [{"session_id", "position", "snippet"}], best match first. Every word must match;
+        a last word of three or more characters also matches as a prefix so results appear while typing.
+        Only the `window` most recent matches are ranked, which keeps common words fast on large archives."""
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        match = " ".join(f'"{w}"' for w in words)
+        if len(words[-1]) >= 3:
+            match += "*"
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.session_id, e.position, m.snippet FROM ("
+                "SELECT rowid, rank, snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet FROM messages_fts "
+                "WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?"
+                ") m JOIN fts_entries e ON e.rowid = m.rowid ORDER BY m.rank LIMIT ?",
+                (match, window, limit),
+            ).fetchall()
+        return [{"session_id": s, "position": p, "snippet": snippet} for s, p, snippet in rows]
@@ -0,0 +1,211 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_ollama_server import MockConfig, start_server
+
+SCENARIOS = ("ch", "chat", "rag")
+QUESTIONS = [
+    "How do I reset the router to factory settings?",
+    "What does error code ERR-4411 mean?",
+    "Summarise the warranty terms for the X200 model.",
+    "Which firmware version fixed the Wi-Fi dropouts?",
+    "How long does a full battery charge take?",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _stream_turn(model, messages):
+    """Streams one reply. Returns (reply, ttft ms, total ms, tokens)."""
+    import ollama_client
+    started = time.perf_counter()
+    ttft = None
+    parts = []
+    for chunk in ollama_client.ChatStream(model, messages):
+        text = chunk["message"]["content"]
+        if text:
+            if ttft is None:
+                ttft = (time.perf_counter() - started) * 1000
+            parts.append(text)
+    total = (time.perf_counter() - started) * 1000
+    return "".join(parts), ttft or total, total, len(parts)
+
+
+def run_ch_session(session, turns, model):
+    """ch.py: one non-streaming request per question, no history."""
+    import ch
+    results = []
+    for turn in range(turns):
+        started = time.perf_counter()
+        answer = ch.reply(QUESTIONS[(session + turn) % len(QUESTIONS)], model=model)
+        total = (time.perf_counter() - started) * 1000
+        # Without streaming the first token arrives with the whole reply
+        results.append({"ttft_ms": total, "latency_ms": total, "tokens": len(answer.split())})
+    return results
+
+
+def run_chat_session(session, turns, model, history_mgr, rag_engine=None):
+    """Headless version of the desktop app's turn: save, (retrieve), window + summary, stream, save."""
+    from context_manager import ContextManager
+    session_id = f"load_{session:04d}"
+    messages = []
+    context_mgr = ContextManager(model)
+    results = []
+    for turn in range(turns):
+        prompt = QUESTIONS[(session + turn) % len(QUESTIONS)]
+        started = time.perf_counter()
+        messages.append({"role": "user", "content": prompt})
+        history_mgr.save_session(session_id, messages)
+        retrieval_ms = 0.0
+        context_prefix = ""
+        if rag_engine is not None:
+            retrieval_started = time.perf_counter()
+            context = rag_engine.retrieve_context(prompt, model=model)
+            retrieval_ms = (time.perf_counter() - retrieval_started) * 1000
+            if context:
+                context_prefix = "Context from Knowledge Base:\n" + "\n\n".join(context) + "\n\nUser Question: "
+        ollama_msgs = context_mgr.build_messages(messages)
+        ollama_msgs[-1] = dict(ollama_msgs[-1], content=context_prefix + ollama_msgs[-1]["content"])
+        stream_started = time.perf_counter()
+        answer, ttft, _, tokens = _stream_turn(model, ollama_msgs)
+        total = (time.perf_counter() - started) * 1000
+        messages.append({"role": "assistant", "content": answer})
+        history_mgr.save_session(session_id, messages)
+        summary = context_mgr.update_summary(messages)
+        if summary:
+            messages.append(summary)
+            history_mgr.save_session(session_id, messages)
+        results.append({
+            "ttft_ms": (stream_started - started) * 1000 + ttft,
+            "latency_ms": total,
+            "tokens": tokens,
+            "retrieval_ms": retrieval_ms,
+        })
+    return results
+
+
+def build_rag_engine(workdir, num_docs):
+    from rag_engine import RAGEngine
+    docs_dir = os.path.join(workdir, "docs")
+    os.makedirs(docs_dir)
+    paths = []
+    for i in range(num_docs):
+        path = os.path.join(docs_dir, f"manual_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for j in range(40):
+                question = QUESTIONS[(i + j) % len(QUESTIONS)]
+                f.write(f"Section {i}.{j}. {question} The answer involves step {j} of procedure {i}. " * 3 + "\n\n")
+        paths.append(path)
+    engine = RAGEngine(persist_directory=os.path.join(workdir, "chroma_db"), backend="numpy")
+    started = time.perf_counter()
+    result = engine.add_documents(paths)
+    print(f"Ingested {result['chunks']} chunks from {num_docs} files in {time.perf_counter() - started:.2f}s")
+    return engine
+
+
+def summarise(name, results, wall_s, errors):
+    ttft = [r["ttft_ms"] for r in results]
+    latency = [r["latency_ms"] for r in results]
+    rates = [r["tokens"] / ((r["latency_ms"] - r["ttft_ms"]) / 1000) for r in results
+             if r["tokens"] > 1 and r["latency_ms"] > r["ttft_ms"]]
+    report = {
+        "scenario": name,
+        "turns": len(results),
+        "errors": errors,
+        "ttft_p50": percentile(ttft, 50), "ttft_p95": percentile(ttft, 95), "ttft_p99": percentile(ttft, 99),
+        "latency_p50": percentile(latency, 50), "latency_p95": percentile(latency, 95),
+        "latency_p99": percentile(latency, 99),
+        "tokens_per_s": sum(rates) / len(rates) if rates else 0.0,
+        "throughput_tokens_per_s": sum(r["tokens"] for r in results) / wall_s if wall_s else 0.0,
+    }
+    retrieval = [r["retrieval_ms"] for r in results if r.get("retrieval_ms")]
+    if retrieval:
+        report["retrieval_p50"] = percentile(retrieval, 50)
+        report["retrieval_p95"] = percentile(retrieval, 95)
+    return report
+
+
+def print_report(report):
+    print(f"\n[{report['scenario']}] {report['turns']} turns, {report['errors']} errors")
+    print(f"  TTFT ms     p50 {report['ttft_p50']:8.1f}  p95 {report['ttft_p95']:8.1f}  p99 {report['ttft_p99']:8.1f}")
+    print(f"  latency ms  p50 {report['latency_p50']:8.1f}  p95 {report['latency_p95']:8.1f}  "
+          f"p99 {report['latency_p99']:8.1f}")
+    if "retrieval_p50" in report:
+        print(f"  retrieval   p50 {report['retrieval_p50']:8.1f}  p95 {report['retrieval_p95']:8.1f}")
+    print(f"  tokens/s per stream {report['tokens_per_s']:.1f}, aggregate {report['throughput_tokens_per_s']:.1f}")
+
+
+def run_scenario(name, sessions, turns, model, workdir, num_docs):
+    from sqlite_history import SQLiteHistoryManager
+    history_mgr = SQLiteHistoryManager(os.path.join(workdir, f"history_{name}"), search=(name != "ch"),
+                                       write_behind=True)
+    rag_engine = build_rag_engine(os.path.join(workdir, name), num_docs) if name == "rag" else None
+    if name == "ch":
+        job = lambda s: run_ch_session(s, turns, model)
+    else:
+        job = lambda s: run_chat_session(s, turns, model, history_mgr, rag_engine)
+
+    results = []
+    errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        for future in [pool.submit(job, s) for s in range(sessions)]:
+            try:
+                results.extend(future.result())
+            except Exception as e:
+                errors += 1
+                print(f"Error in {name} session: {e}")
+    wall_s = time.perf_counter() - started
+    history_mgr.close()
+    return summarise(name, results, wall_s, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test against a real or mock Ollama server")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--model", default="llama3.2")
+    parser.add_argument("--docs", type=int, default=20, help="documents ingested for the rag scenario")
+    parser.add_argument("--host", help="Ollama URL to test; by default a mock server is started in-process")
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--embed-latency", type=float, default=0.01)
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--max-ttft-p95", type=float, help="exit with status 1 if any scenario's p95 TTFT (ms) is higher")
+    args = parser.parse_args()
+
+    if args.host:
+        host = args.host
+    else:
+        _, host = start_server(config=MockConfig(args.token_rate, args.ttft, args.embed_latency, args.reply_tokens))
+        print(f"Started mock Ollama at {host}")
+    # ollama_client reads OLLAMA_HOST when it is first imported
+    os.environ["OLLAMA_HOST"] = host
+
+    workdir = tempfile.mkdtemp(prefix="ollama_load_")
+    failed = False
+    try:
+        for name in (SCENARIOS if args.scenario == "all" else (args.scenario,)):
+            report = run_scenario(name, args.sessions, args.turns, args.model, workdir, args.docs)
+            print_report(report)
+            if report["errors"] or (args.max_ttft_p95 is not None and report["ttft_p95"] > args.max_ttft_p95):
+                failed = True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
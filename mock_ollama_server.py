@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MOCK_MODELS = ["llama3.2", "mistral", "nomic-embed-text"]
+FILLER_WORDS = ("the model would answer here with a plausible sentence about the question and "
+                "then continue with some more detail so that replies have a realistic length").split()
+
+
+class MockConfig:
+    def __init__(self, token_rate=50.0, ttft=0.2, embed_latency=0.01, reply_tokens=64, dim=768):
+        self.token_rate = token_rate        # tokens per second per stream
+        self.ttft = ttft                    # seconds before the first token
+        self.embed_latency = embed_latency  # seconds per embedding request
+        self.reply_tokens = reply_tokens
+        self.dim = dim
+
+
+def embed_text(text, dim):
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Speaks enough of the Ollama API for the apps in this repo. Replies are filler text streamed one token
+    per NDJSON chunk; embeddings are hashed bag-of-words vectors, so similar texts get similar vectors."""
+
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": f"{m}:latest", "model": f"{m}:latest", "size": 0}
+                                        for m in MOCK_MODELS]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        elif self.path == "/":
+            data = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == "/api/chat":
+            messages = body.get("messages") or []
+            self._generate(body, messages[-1].get("content", "") if messages else "", chat=True)
+        elif self.path == "/api/generate":
+            self._generate(body, body.get("prompt") or "", chat=False)
+        elif self.path == "/api/embed":
+            inputs = body.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            time.sleep(self.config.embed_latency)
+            self._send_json({"model": body.get("model", ""),
+                             "embeddings": [embed_text(t, self.config.dim) for t in inputs]})
+        elif self.path == "/api/embeddings":
+            time.sleep(self.config.embed_latency)
+            self._send_json({"embedding": embed_text(body.get("prompt", ""), self.config.dim)})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _reply_tokens(self, prompt, limit):
+        words = re.findall(r"\w+", prompt)[:8] + FILLER_WORDS
+        return [(" " if i else "") + words[i % len(words)] for i in range(limit)]
+
+    def _chunk(self, body, text, chat, done, **extra):
+        chunk = {"model": body.get("model", ""), "created_at": _now(), "done": done}
+        if chat:
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        chunk.update(extra)
+        return chunk
+
+    def _generate(self, body, prompt, chat):
+        config = self.config
+        limit = (body.get("options") or {}).get("num_predict") or config.reply_tokens
+        limit = max(0, min(limit, config.reply_tokens)) if prompt or chat else 0
+        tokens = self._reply_tokens(prompt, limit)
+        stream = body.get("stream", True)
+        started = time.perf_counter()
+        if not tokens:
+            self._send_json(self._chunk(body, "", chat, True, done_reason="load"))
+            return
+        time.sleep(config.ttft)
+        interval = 1.0 / config.token_rate if config.token_rate else 0.0
+        if not stream:
+            time.sleep(interval * (len(tokens) - 1))
+            self._send_json(self._chunk(body, "".join(tokens), chat, True, done_reason="stop",
+                                        eval_count=len(tokens),
+                                        total_duration=int((time.perf_counter() - started) * 1e9)))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(interval)
+                self._write_chunk(self._chunk(body, token, chat, False))
+            self._write_chunk(self._chunk(body, "", chat, True, done_reason="stop", eval_count=len(tokens),
+                                          total_duration=int((time.perf_counter() - started) * 1e9)))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            self.close_connection = True
+
+    def _write_chunk(self, payload):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+def start_server(host="127.0.0.1", port=0, config=None):
+    """Starts the mock server on a background thread. Returns (server, base URL); port 0 picks a free port."""
+    handler = type("ConfiguredMockOllamaHandler", (MockOllamaHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama server for benchmarks and offline runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second per stream")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="seconds per embedding request")
+    parser.add_argument("--reply-tokens", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimensions")
+    args = parser.parse_args()
+    config = MockConfig(args.token_rate, args.ttft, args.embed_latency, args.reply_tokens, args.dim)
+    server, url = start_server(args.host, args.port, config)
+    print(f"Mock Ollama listening on {url} (set OLLAMA_HOST={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+class NumpyVectorStore:
+    """In-process vector store: a memory-mapped embedding matrix plus a JSONL side file of texts and metadata.
+
+    Rows are L2-normalised on insert so exact cosine top-k is one matmul plus argpartition. Only chunk ids
+    and the byte offset of each row's JSONL record are held in memory; texts and metadata are read from disk
+    for the rows a query returns. Deletes are tombstoned and compacted away once they make up a quarter of
+    the rows. Implements the subset of the Chroma API that RAGEngine relies on.
+    """
+
+    def __init__(self, persist_directory, embedding_function, dtype="float32", block_rows=65536):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype!r}, expected one of {sorted(DTYPES)}")
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self._lock = threading.Lock()
+        if not os.path.exists(self.persist_directory):
+            os.makedirs(self.persist_directory)
+        self._vectors_path = os.path.join(self.persist_directory, f"vectors.{dtype}")
+        self._scales_path = os.path.join(self.persist_directory, "scales.float32")
+        self._records_path = os.path.join(self.persist_directory, "records.jsonl")
+        self._offsets_path = os.path.join(self.persist_directory, "offsets.int64")
+        self._ids_path = os.path.join(self.persist_directory, "ids.txt")
+        self._deleted_path = os.path.join(self.persist_directory, "deleted.txt")
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self._records_path) and not os.path.exists(self._ids_path):
+            self._build_row_index()
+        self.ids = []
+        self._offsets = np.empty(0, dtype=np.int64)
+        self.dim = None
+        if os.path.exists(self._ids_path):
+            with open(self._ids_path, "r", encoding="utf-8") as f:
+                self.ids = f.read().splitlines()
+            self._offsets = np.fromfile(self._offsets_path, dtype=np.int64)[:len(self.ids)]
+        if self.ids:
+            self.dim = self._read_records([0])[0]["dim"]
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._alive = np.ones(len(self.ids), dtype=bool)
+        if os.path.exists(self._deleted_path):
+            with open(self._deleted_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    row = self._row_of.pop(line.strip(), None)
+                    if row is not None:
+                        self._alive[row] = False
+        self._remap()
+
+    def _build_row_index(self):
+        """One pass over a records file written before the id and offset side files existed."""
+        ids = []
+        offsets = []
+        with open(self._records_path, "rb") as f:
+            offset = 0
+            for line in f:
+                ids.append(json.loads(line)["id"])
+                offsets.append(offset)
+                offset += len(line)
+        np.asarray(offsets, dtype=np.int64).tofile(self._offsets_path)
+        with open(self._ids_path, "w", encoding="utf-8") as f:
+            f.writelines(chunk_id + "\n" for chunk_id in ids)
+
+    def _read_records(self, rows):
+        """Reads the JSONL records of the given rows, in the order given."""
+        records = []
+        with open(self._records_path, "rb") as f:
+            for row in rows:
+                f.seek(int(self._offsets[row]))
+                records.append(json.loads(f.readline()))
+        return records
+
+    def _remap(self):
+        if self.ids and self.dim:
+            self._matrix = np.memmap(self._vectors_path, dtype=DTYPES[self.dtype], mode="r",
+                                     shape=(len(self.ids), self.dim))
+            self._scales = (np.fromfile(self._scales_path, dtype=np.float32)
+                            if self.dtype == "int8" else None)
+        else:
+            self._matrix = None
+            self._scales = None
+
+    def _encode(self, vectors):
+        """Normalises rows and converts them to the on-disk dtype. Returns (rows, per-row scales or None)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(DTYPES[self.dtype]), None
+
+    def add_documents(self, documents, ids=None):
+        texts = [doc.page_content for doc in documents]
+        ids = ids or [doc.id for doc in documents]
+        vectors = self.embedding_function.embed_documents(texts)
+        rows, scales = self._encode(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = rows.shape[1]
+            self._matrix = None  # release the map before growing the file
+            with open(self._vectors_path, "ab") as f:
+                f.write(rows.tobytes())
+            if scales is not None:
+                with open(self._scales_path, "ab") as f:
+                    f.write(scales.tobytes())
+            offset = os.path.getsize(self._records_path) if os.path.exists(self._records_path) else 0
+            offsets = []
+            with open(self._records_path, "ab") as f:
+                for chunk_id, doc in zip(ids, documents):
+                    line = json.dumps({"id": chunk_id, "text": doc.page_content, "metadata": doc.metadata,
+                                       "dim": self.dim}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    f.write(line)
+                    offsets.append(offset)
+                    offset += len(line)
+            offsets = np.asarray(offsets, dtype=np.int64)
+            with open(self._offsets_path, "ab") as f:
+                f.write(offsets.tobytes())
+            # The id file is written last: a row exists once its id does
+            with open(self._ids_path, "a", encoding="utf-8") as f:
+                f.writelines(chunk_id + "\n" for chunk_id in ids)
+            start = len(self.ids)
+            for index, chunk_id in enumerate(ids):
+                self.ids.append(chunk_id)
+                self._row_of[chunk_id] = start + index
+            self._offsets = np.concatenate([self._offsets, offsets])
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            self._remap()
+        return ids
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        with self._lock:
+            if self._matrix is None or not self._row_of:
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            scores = np.empty(len(self.ids), dtype=np.float32)
+            for start in range(0, len(self.ids), self.block_rows):
+                block = np.asarray(self._matrix[start:start + self.block_rows], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+            if self._scales is not None:
+                scores *= self._scales
+            scores[~self._alive] = -np.inf
+            k = min(k, len(self._row_of))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            records = self._read_records(top)
+            return [Document(page_content=record["text"], metadata=record["metadata"], id=record["id"])
+                    for record in records]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        include = ["documents", "metadatas"] if include is None else include
+        with self._lock:
+            if ids is not None:
+                rows = [self._row_of[i] for i in ids if i in self._row_of]
+            else:
+                rows = sorted(self._row_of.values())
+            if where:
+                # Reads every candidate's record; only used for chunks that predate the source manifest
+                rows = [row for row, record in zip(rows, self._read_records(rows))
+                        if all(record["metadata"].get(key) == value for key, value in where.items())]
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            data = {"ids": [self.ids[r] for r in rows]}
+            if "documents" in include or "metadatas" in include:
+                records = self._read_records(rows)
+                if "documents" in include:
+                    data["documents"] = [record["text"] for record in records]
+                if "metadatas" in include:
+                    data["metadatas"] = [record["metadata"] for record in records]
+        return data
+
+    def delete(self, ids=None, **kwargs):
+        with self._lock:
+            removed = [i for i in ids or [] if i in self._row_of]
+            for chunk_id in removed:
+                self._alive[self._row_of.pop(chunk_id)] = False
+            with open(self._deleted_path, "a", encoding="utf-8") as f:
+                f.writelines(chunk_id + "\n" for chunk_id in removed)
+            if len(self.ids) and (~self._alive).sum() > len(self.ids) // 4:
+                self._compact()
+
+    def _compact(self):
+        """Rewrites the matrix and side files without tombstoned rows, streaming the records file."""
+        keep = np.flatnonzero(self._alive)
+        if self._matrix is not None:
+            kept_rows = np.array(self._matrix[keep])
+        else:
+            kept_rows = np.empty((0, self.dim or 0), dtype=DTYPES[self.dtype])
+        kept_scales = self._scales[keep] if self._scales is not None else None
+        self._matrix = None
+        kept_rows.tofile(self._vectors_path)
+        if kept_scales is not None:
+            kept_scales.tofile(self._scales_path)
+        offsets = np.empty(len(keep), dtype=np.int64)
+        offset = 0
+        tmp_path = self._records_path + ".tmp"
+        with open(self._records_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for index, row in enumerate(keep):
+                src.seek(int(self._offsets[row]))
+                line = src.readline()
+                dst.write(line)
+                offsets[index] = offset
+                offset += len(line)
+        os.replace(tmp_path, self._records_path)
+        self.ids = [self.ids[r] for r in keep]
+        self._offsets = offsets
+        offsets.tofile(self._offsets_path)
+        with open(self._ids_path, "w", encoding="utf-8") as f:
+            f.writelines(chunk_id + "\n" for chunk_id in self.ids)
+        if os.path.exists(self._deleted_path):
+            os.remove(self._deleted_path)
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._alive = np.ones(len(self.ids), dtype=bool)
+        self._remap()
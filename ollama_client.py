@@ -0,0 +1,156 @@
+import os
+import threading
+
+import httpx
+import ollama
+from langchain_ollama import OllamaEmbeddings
+from response_cache import ResponseCache, response_key, replay_chunks
+
+# None falls back to the OLLAMA_HOST environment variable, then http://localhost:11434
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST")
+EMBEDDING_MODEL = "nomic-embed-text"
+RESPONSE_CACHE_PATH = "response_cache.sqlite3"
+
+# Seconds Ollama keeps a model loaded after its last request (-1 keeps it loaded until the server stops)
+KEEP_ALIVE = {
+    "mistral": 30 * 60,
+    "llama3.2": 30 * 60,
+    "nomic-embed-text": 60 * 60,
+}
+DEFAULT_KEEP_ALIVE = 15 * 60
+
+# Enough connections for concurrent streams, embedding batches and titling without opening new sockets
+CONNECTION_LIMITS = httpx.Limits(max_connections=16, max_keepalive_connections=8)
+
+_client = None
+_response_cache = None
+_client_lock = threading.Lock()
+
+
+def keep_alive_for(model):
+    return KEEP_ALIVE.get((model or "").split(":", 1)[0], DEFAULT_KEEP_ALIVE)
+
+
+def get_client():
+    """The process-wide ollama.Client; its HTTP connection pool is shared by every caller."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ollama.Client(host=OLLAMA_HOST, limits=CONNECTION_LIMITS)
+        return _client
+
+
+def get_response_cache():
+    global _response_cache
+    with _client_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+        return _response_cache
+
+
+def _cacheable(cache, options):
+    """cache=True uses the response cache only for deterministic requests (temperature 0); "force" always does."""
+    if cache == "force":
+        return True
+    return bool(cache) and (options or {}).get("temperature") == 0
+
+
+def chat(model, messages, cache=False, **kwargs):
+    """ollama.Client.chat with the model's keep_alive. With cache set (see _cacheable) identical requests are
+    answered from the response cache, replayed as a stream when stream=True."""
+    kwargs.setdefault("keep_alive", keep_alive_for(model))
+    if not _cacheable(cache, kwargs.get("options")):
+        return get_client().chat(model=model, messages=messages, **kwargs)
+
+    response_cache = get_response_cache()
+    stream = kwargs.get("stream", False)
+    key = response_key(model, messages, {k: v for k, v in kwargs.items() if k not in ("stream", "keep_alive")})
+    cached = response_cache.get(key)
+    if cached is not None:
+        if stream:
+            return replay_chunks(model, cached)
+        return {"model": model, "message": {"role": "assistant", "content": cached}, "done": True}
+    response = get_client().chat(model=model, messages=messages, **kwargs)
+    if not stream:
+        response_cache.put(key, model, response["message"]["content"])
+        return response
+    return _record_stream(response, response_cache, key, model)
+
+
+def _record_stream(stream, response_cache, key, model):
+    """Passes a stream through and caches the reply once it completes; cancelled streams are not cached."""
+    parts = []
+    try:
+        for chunk in stream:
+            parts.append(chunk["message"]["content"])
+            if chunk.get("done"):
+                response_cache.put(key, model, "".join(parts))
+            yield chunk
+    finally:
+        stream.close()
+
+
+class ChatStream:
+    """A streamed chat reply that can be cancelled from any thread. Iteration stops at the next chunk after
+    cancel() and the HTTP response is closed, which makes Ollama abort the generation and free its slot."""
+
+    def __init__(self, model, messages, cancel_event=None, **kwargs):
+        self.model = model
+        self.messages = messages
+        self.kwargs = kwargs
+        self.cancel_event = cancel_event or threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def __iter__(self):
+        if self.cancelled:
+            return
+        stream = chat(self.model, self.messages, stream=True, **self.kwargs)
+        try:
+            for chunk in stream:
+                if self.cancelled:
+                    break
+                yield chunk
+        finally:
+            stream.close()
+
+
+def list_models():
+    return get_client().list()
+
+
+def embeddings(model=EMBEDDING_MODEL):
+    """LangChain embeddings for the RAG engine with the same host and keep_alive policy."""
+    return OllamaEmbeddings(
+        model=model,
+        base_url=OLLAMA_HOST,
+        keep_alive=keep_alive_for(model),
+        client_kwargs={"limits": CONNECTION_LIMITS},
+    )
+
+
+def warm_up(models, embedding_model=EMBEDDING_MODEL):
+    """Loads the given chat models (and the embedder) in a background thread so the first real request
+    does not pay the model-load time. Returns the thread."""
+    def _warm():
+        client = get_client()
+        for model in dict.fromkeys(models):
+            try:
+                # An empty prompt makes Ollama load the model without generating anything
+                client.generate(model=model, prompt="", keep_alive=keep_alive_for(model))
+            except Exception as e:
+                print(f"Error warming up {model}: {e}")
+        if embedding_model:
+            try:
+                client.embed(model=embedding_model, input="warm-up", keep_alive=keep_alive_for(embedding_model))
+            except Exception as e:
+                print(f"Error warming up {embedding_model}: {e}")
+
+    thread = threading.Thread(target=_warm, daemon=True)
+    thread.start()
+    return thread
@@ -1,55 +1,557 @@
 import os
+import asyncio
+import itertools
+import math
+import multiprocessing
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
+from embedding_cache import EmbeddingCache, CachedEmbeddings, LRUCache
+from source_manifest import SourceManifest, file_sha256
+from bm25_index import BM25Index
+from semantic_cache import SemanticCache
+from token_counter import count_tokens, context_token_budget
+import ollama_client
+from ollama_client import EMBEDDING_MODEL
+
+RRF_K = 60
+
+def _load_file(file_path):
+    """Parses one file into pages. Module-level so it can run in a worker process."""
+    if file_path.endswith(".pdf"):
+        loader = PyPDFLoader(file_path)
+    else:
+        loader = TextLoader(file_path, encoding='utf-8')
+    return loader.load()
+
+def _iter_text_windows(file_path, buffer_chars):
+    """Reads a text file lazily as Documents of roughly buffer_chars, cut at line boundaries where possible."""
+    carry = ""
+    with open(file_path, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(buffer_chars)
+            if not block:
+                break
+            text = carry + block
+            cut = text.rfind("\n")
+            if cut <= 0:
+                cut = len(text) - 1
+            carry = text[cut + 1:]
+            yield Document(page_content=text[:cut + 1], metadata={"source": file_path})
+    if carry:
+        yield Document(page_content=carry, metadata={"source": file_path})
+
+def _is_identifier_query(question):
+    """True for short queries where every word carries a digit, e.g. "ERR-4411" or "part 88-120"."""
+    words = question.split()
+    return 0 < len(words) <= 3 and all(any(c.isdigit() for c in w) for w in words)
+
+def _reciprocal_rank_fusion(rankings):
+    """Merges ranked lists of chunks; each list contributes 1 / (RRF_K + rank) per chunk."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking):
+            scores[chunk] = scores.get(chunk, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _shingles(text, size=5):
+    words = text.split()
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def _strip_overlap(previous, text, min_overlap=20, max_overlap=300):
+    """Drops the prefix of text that repeats the tail of previous (the splitter's chunk_overlap)."""
+    for size in range(min(max_overlap, len(previous), len(text)), min_overlap - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
 
 class RAGEngine:
-    def __init__(self, persist_directory="./chroma_db"):
+    def __init__(self, persist_directory="./chroma_db", embedding_cache_bytes=256 * 1024 * 1024,
+                 embed_batch_size=32, embed_concurrency=4, load_workers=None, query_cache_size=256,
+                 backend="chroma", vector_dtype="float32",
+                 stream_buffer_chars=1_000_000, stream_threshold_bytes=50 * 1024 * 1024,
+                 answer_cache_threshold=0.92):
+        if backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown vector store backend: {backend}")
         self.persist_directory = persist_directory
-        # Using Ollama for embeddings
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
+        # "numpy" keeps embeddings in a memory-mapped matrix with exact top-k search (see numpy_store.py);
+        # vector_dtype ("float32", "float16" or "int8") only applies to that backend.
+        self.backend = backend
+        self.vector_dtype = vector_dtype
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.load_workers = load_workers or os.cpu_count() or 1
+        # Bounds how much of a single file is held in memory at once while it is split and embedded
+        self.stream_buffer_chars = stream_buffer_chars
+        self.stream_threshold_bytes = stream_threshold_bytes
+        # Using Ollama for embeddings, with a persistent cache so re-ingested chunks are not re-embedded.
+        # The cache lives next to the vector store so clearing the knowledge base keeps it warm.
+        self.embedding_cache = EmbeddingCache(
+            os.path.normpath(persist_directory) + "_embedding_cache.sqlite3",
+            max_bytes=embedding_cache_bytes
+        )
+        self.embeddings = CachedEmbeddings(
+            ollama_client.embeddings(EMBEDDING_MODEL), self.embedding_cache, EMBEDDING_MODEL
+        )
+        # Per-source record of what was ingested, used to skip unchanged files on re-upload
+        self.manifest = SourceManifest(os.path.normpath(persist_directory) + "_manifest.sqlite3")
+        # Lexical index kept alongside Chroma for exact identifiers, error codes and part numbers
+        self.lexical_index = BM25Index(os.path.normpath(persist_directory) + "_bm25.sqlite3")
+        # Question -> embedding, and (question, k, KB version) -> chunks. Bumping the version on every
+        # add/delete/clear makes stale retrieval results unreachable.
+        self.kb_version = int(self.manifest.get_meta("kb_version", 0))
+        self.query_embedding_cache = LRUCache(query_cache_size)
+        self.retrieval_cache = LRUCache(query_cache_size)
+        # Answers to earlier questions, reused for paraphrases asked of the same model and KB version
+        self.answer_cache = SemanticCache(
+            os.path.normpath(persist_directory) + "_answer_cache.sqlite3", threshold=answer_cache_threshold
+        )
+        self._embed_ms = 0.0
+        self._retrieval_ms = 0.0
+        self._async_semaphores = weakref.WeakKeyDictionary()
         self.vector_store = None
         self._load_vector_store()
 
+    def _open_vector_store(self):
+        if self.backend == "numpy":
+            from numpy_store import NumpyVectorStore
+            return NumpyVectorStore(self.persist_directory, self.embeddings, dtype=self.vector_dtype)
+        return Chroma(
+            persist_directory=self.persist_directory,
+            embedding_function=self.embeddings
+        )
+
     def _load_vector_store(self):
         if os.path.exists(self.persist_directory):
-            self.vector_store = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings
-            )
+            self.vector_store = self._open_vector_store()
+            if not self.manifest.get_meta("backfilled"):
+                self._backfill_manifest()
+            if not self.manifest.get_meta("lexical_indexed"):
+                self._backfill_lexical_index()
         else:
             self.vector_store = None
 
+    def _backfill_manifest(self):
+        """One-time scan that indexes a knowledge base created before the manifest existed."""
+        try:
+            if self.manifest.list_sources():
+                self.manifest.set_meta("backfilled", "1")
+                return
+            data = self.vector_store.get(include=["metadatas"])
+            pairs = [
+                (chunk_id, meta["source"])
+                for chunk_id, meta in zip(data.get("ids", []), data.get("metadatas", []))
+                if meta and "source" in meta
+            ]
+            self.manifest.backfill(pairs)
+        except Exception as e:
+            print(f"Error indexing existing knowledge base: {e}")
+
+    def _backfill_lexical_index(self, page_size=1000):
+        """One-time, paged scan that builds the BM25 index for chunks written before it existed."""
+        try:
+            if self.lexical_index.is_empty():
+                offset = 0
+                while True:
+                    data = self.vector_store.get(limit=page_size, offset=offset, include=["documents"])
+                    ids = data.get("ids", [])
+                    if not ids:
+                        break
+                    self.lexical_index.add(ids, data["documents"])
+                    offset += len(ids)
+            self.manifest.set_meta("lexical_indexed", "1")
+        except Exception as e:
+            print(f"Error building lexical index: {e}")
+
     def add_documents(self, file_paths):
-        documents = []
+        """Streams files through load -> split -> embed -> write, batching embeddings as chunks arrive.
+        Files whose content is unchanged since the last ingestion are skipped; changed files replace their old
+        chunks once the new ones are written."""
+        before = self.embeddings.stats()
+        to_ingest, skipped = self._plan_ingest(file_paths)
+        chunk_ids = {file_path: [] for file_path in to_ingest}
+        num_chunks = 0
+        pending = set()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.embed_concurrency) as writer:
+                for batch, batch_ids in self._iter_batches(to_ingest, chunk_ids):
+                    pending = self._submit_batch(writer, pending, batch, batch_ids)
+                    num_chunks += len(batch)
+                for future in pending:
+                    future.result()
+        except BaseException:
+            self._discard_chunks(chunk_ids)
+            raise
+
+        self._record_ingest(to_ingest, chunk_ids)
+        return self._ingest_result(before, num_chunks, skipped)
+
+    async def aadd_documents(self, file_paths):
+        """Async add_documents. At most embed_concurrency batches are embedded at once; cancelling the
+        task stops scheduling new batches, and files are only recorded as ingested if every batch completed."""
+        before = self.embeddings.stats()
+        to_ingest, skipped = await asyncio.to_thread(self._plan_ingest, file_paths)
+        chunk_ids = {file_path: [] for file_path in to_ingest}
+        num_chunks = 0
+        semaphore = self._async_semaphore()
+        batches = self._iter_batches(to_ingest, chunk_ids)
+        reading = None
+        writes = set()
+
+        try:
+            while True:
+                # Worker threads cannot be interrupted, so they are shielded from cancellation and awaited below
+                reading = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+                item = await asyncio.shield(reading)
+                if item is None:
+                    break
+                batch, batch_ids = item
+                if self.vector_store is None:
+                    self.vector_store = self._open_vector_store()
+                await semaphore.acquire()
+                write = asyncio.ensure_future(asyncio.to_thread(self._write_batch, batch, batch_ids))
+                write.add_done_callback(lambda _: semaphore.release())
+                writes.add(write)
+                num_chunks += len(batch)
+                finished = {write for write in writes if write.done()}
+                for write in finished:
+                    write.result()
+                writes -= finished
+            await asyncio.shield(asyncio.gather(*writes))
+        except BaseException:
+            # Let batches already being written land before removing them, and stop the PDF process pool
+            outstanding = writes | ({reading} if reading is not None else set())
+            await asyncio.gather(*outstanding, return_exceptions=True)
+            await asyncio.to_thread(batches.close)
+            self._discard_chunks(chunk_ids)
+            raise
+
+        await asyncio.to_thread(self._record_ingest, to_ingest, chunk_ids)
+        return self._ingest_result(before, num_chunks, skipped)
+
+    def _plan_ingest(self, file_paths):
+        """Returns ({path: (content_hash, mtime, size)} to ingest, number of unchanged files skipped)."""
+        to_ingest = {}
+        skipped = 0
         for file_path in file_paths:
-            if file_path.endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-            else:
-                loader = TextLoader(file_path, encoding='utf-8')
-            documents.extend(loader.load())
+            stat = os.stat(file_path)
+            entry = self.manifest.get(file_path)
+            if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                skipped += 1
+                continue
+            content_hash = file_sha256(file_path)
+            if entry and entry["content_hash"] == content_hash:
+                self.manifest.touch(file_path, stat.st_mtime, stat.st_size)
+                skipped += 1
+                continue
+            to_ingest[file_path] = (content_hash, stat.st_mtime, stat.st_size)
+        return to_ingest, skipped
 
+    def _iter_batches(self, to_ingest, chunk_ids):
+        """Splits files as they load and yields (chunks, ids) micro-batches, recording each id under its source."""
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        splits = text_splitter.split_documents(documents)
+        batch = []
+        batch_ids = []
+        for documents in self._iter_loaded_files(list(to_ingest)):
+            for chunk in text_splitter.split_documents(documents):
+                chunk_id = str(uuid.uuid4())
+                chunk_ids[chunk.metadata["source"]].append(chunk_id)
+                batch.append(chunk)
+                batch_ids.append(chunk_id)
+                if len(batch) >= self.embed_batch_size:
+                    yield batch, batch_ids
+                    batch, batch_ids = [], []
+            del documents
+        if batch:
+            yield batch, batch_ids
+
+    def _discard_chunks(self, chunk_ids):
+        """Best-effort removal of chunks written by an ingestion that failed or was cancelled part-way."""
+        ids = [chunk_id for ids in chunk_ids.values() for chunk_id in ids]
+        if ids and self.vector_store is not None:
+            try:
+                self.vector_store.delete(ids=ids)
+                self.lexical_index.remove(ids)
+            except Exception as e:
+                print(f"Error discarding partial ingestion: {e}")
+
+    def _record_ingest(self, to_ingest, chunk_ids):
+        # Only record sources once all of their chunks are safely written. A changed file's previous chunks
+        # are removed only now, so a failed re-upload leaves the old version in the knowledge base
+        for file_path, (content_hash, mtime, size) in to_ingest.items():
+            replaced = self._replaced_chunk_ids(file_path, chunk_ids[file_path])
+            self.manifest.record(file_path, content_hash, mtime, size, chunk_ids[file_path])
+            if replaced:
+                try:
+                    self.vector_store.delete(ids=replaced)
+                    self.lexical_index.remove(replaced)
+                except Exception as e:
+                    print(f"Error removing old chunks of {file_path}: {e}")
+        if to_ingest:
+            self._bump_kb_version()
+
+    def _replaced_chunk_ids(self, file_path, new_ids):
+        """Ids of the chunks an earlier ingestion of file_path wrote, excluding the new ones."""
+        if self.manifest.get(file_path) is None or self.vector_store is None:
+            return []
+        ids = self.manifest.chunk_ids(file_path)
+        if not ids:
+            # Chunks written before the manifest existed are still found by metadata
+            data = self.vector_store.get(where={"source": file_path}, include=[])
+            ids = data.get("ids", []) if data else []
+        new_ids = set(new_ids)
+        return [chunk_id for chunk_id in ids if chunk_id not in new_ids]
+
+    def _ingest_result(self, before, num_chunks, skipped):
+        after = self.embeddings.stats()
+        return {
+            "chunks": num_chunks,
+            "skipped_files": skipped,
+            "cache_hits": after["hits"] - before["hits"],
+            "cache_misses": after["misses"] - before["misses"]
+        }
+
+    def _iter_loaded_files(self, file_paths):
+        """Yields lists of pages as soon as they are parsed. Text files and PDFs above stream_threshold_bytes
+        are read lazily in windows of about stream_buffer_chars; smaller PDFs are parsed in a process pool."""
+        pdfs = []
+        for file_path in file_paths:
+            if not file_path.endswith(".pdf"):
+                for window in _iter_text_windows(file_path, self.stream_buffer_chars):
+                    yield [window]
+            elif os.path.getsize(file_path) > self.stream_threshold_bytes:
+                for page in PyPDFLoader(file_path).lazy_load():
+                    yield [page]
+            else:
+                pdfs.append(file_path)
+
+        if len(pdfs) <= 1:
+            for file_path in pdfs:
+                yield _load_file(file_path)
+            return
 
+        workers = min(self.load_workers, len(pdfs))
+        # Spawned, not forked: uploads start from worker threads of a multithreaded process, and a forked child
+        # can inherit locks held by other threads and deadlock
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            remaining = iter(pdfs)
+            # Keep only a couple of parsed files per worker in flight so memory does not grow with the corpus
+            in_flight = {pool.submit(_load_file, p) for p in itertools.islice(remaining, workers * 2)}
+            try:
+                while in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        next_path = next(remaining, None)
+                        if next_path is not None:
+                            in_flight.add(pool.submit(_load_file, next_path))
+                        yield future.result()
+            except GeneratorExit:
+                # Closed early (cancelled upload): do not wait for files nobody will read
+                for future in in_flight:
+                    future.cancel()
+                raise
+
+    def _submit_batch(self, writer, pending, batch, ids):
+        """Queues one micro-batch for embedding and writing, blocking while too many are in flight."""
+        if self.vector_store is None:
+            self.vector_store = self._open_vector_store()
+        if len(pending) >= self.embed_concurrency * 2:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        pending.add(writer.submit(self._write_batch, batch, ids))
+        return pending
+
+    def _write_batch(self, batch, ids):
+        self.vector_store.add_documents(batch, ids=ids)
+        self.lexical_index.add(ids, [doc.page_content for doc in batch])
+
+    def query(self, question, k=3, mode="hybrid"):
+        """Returns the top-k chunks. mode is "hybrid" (BM25 + vector, fused with reciprocal rank fusion),
+        "vector" or "lexical". Hybrid queries made only of identifiers skip the embedding call when BM25 finds enough."""
         if self.vector_store is None:
-            self.vector_store = Chroma.from_documents(
-                documents=splits,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory
-            )
+            return []
+
+        key = (question, k, mode, self.kb_version)
+        cached = self.retrieval_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        started = time.perf_counter()
+        lexical = self._lexical_search(question, k, mode)
+        if self._lexical_only(question, k, mode, lexical):
+            chunks = lexical[:k]
         else:
-            self.vector_store.add_documents(splits)
-        
-        return len(splits)
+            chunks = self._vector_search(self._embed_query(question), k, lexical)
 
-    def query(self, question, k=3):
+        self._retrieval_ms += (time.perf_counter() - started) * 1000
+        self.retrieval_cache.put(key, tuple(chunks))
+        return chunks
+
+    async def aquery(self, question, k=3, mode="hybrid"):
+        """Async query. The question is embedded with Ollama's async client under the embed_concurrency limit,
+        and the index lookups run in worker threads, so many sessions can share one event loop."""
         if self.vector_store is None:
             return []
-        
-        results = self.vector_store.similarity_search(question, k=k)
-        return [doc.page_content for doc in results]
+
+        key = (question, k, mode, self.kb_version)
+        cached = self.retrieval_cache.get(key)
+        if cached is not None:
+            return list(cached)
+
+        started = time.perf_counter()
+        lexical = await asyncio.to_thread(self._lexical_search, question, k, mode)
+        if self._lexical_only(question, k, mode, lexical):
+            chunks = lexical[:k]
+        else:
+            embedding = await self._aembed_query(question)
+            chunks = await asyncio.to_thread(self._vector_search, embedding, k, lexical)
+
+        self._retrieval_ms += (time.perf_counter() - started) * 1000
+        self.retrieval_cache.put(key, tuple(chunks))
+        return chunks
+
+    def retrieve_context(self, question, model=None, token_budget=None, fetch_k=12, max_chunks=3, mmr_lambda=0.7):
+        """Over-fetches candidates, drops near-duplicates and re-ranks them with maximal marginal relevance,
+        then packs the best max_chunks chunks into the model's context token budget. Only the candidate
+        pool is larger than plain top-3 retrieval; the context sent to the model is not."""
+        candidates = self.query(question, k=fetch_k)
+        if not candidates:
+            return []
+        budget = token_budget or context_token_budget(model)
+
+        distinct = []
+        seen = []
+        for text in candidates:
+            shingles = _shingles(text)
+            if any(len(shingles & other) / len(shingles | other) > 0.6 for other in seen):
+                continue
+            seen.append(shingles)
+            distinct.append(text)
+
+        if _is_identifier_query(question) or len(distinct) <= 1:
+            ranked = distinct
+        else:
+            ranked = self._mmr(question, distinct, mmr_lambda)
+
+        packed = []
+        used = 0
+        for text in ranked:
+            for previous in packed:
+                text = _strip_overlap(previous, text)
+            if not text:
+                continue
+            tokens = count_tokens(text, model)
+            if used + tokens > budget:
+                continue
+            packed.append(text)
+            used += tokens
+            if len(packed) >= max_chunks:
+                break
+        return packed
+
+    def cached_answer(self, question, model):
+        """Returns a stored answer to a question similar enough to this one, or None. The question
+        embedding is the one retrieval uses, so a miss costs no extra embedding call."""
+        if not self.has_knowledge():
+            return None
+        hit = self.answer_cache.lookup(self._embed_query(question), model, self.kb_version)
+        return hit["answer"] if hit else None
+
+    def store_answer(self, question, model, answer, kb_version=None):
+        """Records a completed answer for cached_answer. Pass the kb_version read before retrieval so an
+        answer generated while the knowledge base changed is not stored against the new version."""
+        kb_version = self.kb_version if kb_version is None else kb_version
+        if answer and kb_version == self.kb_version:
+            self.answer_cache.store(question, self._embed_query(question), answer, model, kb_version)
+
+    def _mmr(self, question, texts, mmr_lambda):
+        """Greedy MMR order. Chunk embeddings usually come straight from the embedding cache."""
+        query_vector = self._embed_query(question)
+        vectors = self.embeddings.embed_documents(texts)
+        relevance = [_cosine(query_vector, v) for v in vectors]
+        order = []
+        remaining = list(range(len(texts)))
+        while remaining:
+            def score(i):
+                redundancy = max((_cosine(vectors[i], vectors[j]) for j in order), default=0.0)
+                return mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+            best = max(remaining, key=score)
+            order.append(best)
+            remaining.remove(best)
+        return [texts[i] for i in order]
+
+    def _lexical_search(self, question, k, mode):
+        if mode not in ("hybrid", "lexical"):
+            return []
+        return [content for _, _, content in self.lexical_index.search(question, k=k * 4)]
+
+    def _lexical_only(self, question, k, mode, lexical):
+        return mode == "lexical" or (mode == "hybrid" and _is_identifier_query(question) and len(lexical) >= k)
+
+    def _vector_search(self, embedding, k, lexical):
+        results = self.vector_store.similarity_search_by_vector(embedding, k=k * 4 if lexical else k)
+        vector = [doc.page_content for doc in results]
+        return _reciprocal_rank_fusion([vector, lexical])[:k] if lexical else vector[:k]
+
+    def _embed_query(self, question):
+        embedding = self.query_embedding_cache.get(question)
+        if embedding is None:
+            started = time.perf_counter()
+            embedding = self.embeddings.embed_query(question)
+            self._embed_ms += (time.perf_counter() - started) * 1000
+            self.query_embedding_cache.put(question, embedding)
+        return embedding
+
+    async def _aembed_query(self, question):
+        embedding = self.query_embedding_cache.get(question)
+        if embedding is None:
+            async with self._async_semaphore():
+                started = time.perf_counter()
+                embedding = await self.embeddings.aembed_query(question)
+                self._embed_ms += (time.perf_counter() - started) * 1000
+            self.query_embedding_cache.put(question, embedding)
+        return embedding
+
+    def _async_semaphore(self):
+        """One embedding semaphore per event loop, since asyncio primitives cannot be shared across loops."""
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.embed_concurrency)
+            self._async_semaphores[loop] = semaphore
+        return semaphore
+
+    def cache_stats(self):
+        """Hit/miss counters for the query caches, with the estimated time saved by hits."""
+        embed = self.query_embedding_cache.stats()
+        retrieval = self.retrieval_cache.stats()
+        avg_embed = self._embed_ms / embed["misses"] if embed["misses"] else 0.0
+        avg_retrieval = self._retrieval_ms / retrieval["misses"] if retrieval["misses"] else 0.0
+        return {
+            "query_embedding": embed,
+            "retrieval": retrieval,
+            "answers": self.answer_cache.stats(),
+            "kb_version": self.kb_version,
+            "estimated_saved_ms": round(embed["hits"] * avg_embed + retrieval["hits"] * avg_retrieval, 1)
+        }
+
+    def _bump_kb_version(self):
+        self.kb_version += 1
+        self.manifest.set_meta("kb_version", self.kb_version)
+        self.retrieval_cache.clear()
+        self.answer_cache.invalidate(self.kb_version)
 
     def clear_database(self):
         if self.vector_store:
@@ -57,6 +559,9 @@ class RAGEngine:
             import gc
             # Close the vector store if it has a persist or client
             self.vector_store = None
+            self.manifest.clear()
+            self.lexical_index.clear()
+            self._bump_kb_version()
             # Force garbage collection to release file handles
             gc.collect()
             
@@ -76,25 +581,30 @@ class RAGEngine:
         if not self.vector_store:
             return {}
         try:
-            data = self.vector_store.get()
-            if "metadatas" in data and data["metadatas"]:
-                sources = {}
-                for meta in data["metadatas"]:
-                    if meta and "source" in meta:
-                        basename = os.path.basename(meta["source"])
-                        sources[basename] = meta["source"]
-                return sources
+            sources = {}
+            for source in self.manifest.list_sources():
+                sources[os.path.basename(source)] = source
+            return sources
         except Exception as e:
             print(f"Error getting sources: {e}")
         return {}
 
     def delete_file(self, source_path):
-        if self.vector_store:
-            try:
-                data = self.vector_store.get(where={"source": source_path})
-                if data and "ids" in data and data["ids"]:
-                    self.vector_store.delete(ids=data["ids"])
-                    return True
-            except Exception as e:
-                print(f"Error deleting file {source_path}: {e}")
+        try:
+            # Sources that produced no chunks (e.g. an empty file) are only in the manifest
+            known = self.manifest.get(source_path) is not None
+            ids = self.manifest.chunk_ids(source_path)
+            if not ids and self.vector_store:
+                # Chunks written before the manifest existed are still found by metadata
+                data = self.vector_store.get(where={"source": source_path}, include=[])
+                ids = data.get("ids", []) if data else []
+            if ids and self.vector_store:
+                self.vector_store.delete(ids=ids)
+                self.lexical_index.remove(ids)
+                self._bump_kb_version()
+            if known:
+                self.manifest.remove(source_path)
+            return bool(ids) or known
+        except Exception as e:
+            print(f"Error deleting file {source_path}: {e}")
         return False
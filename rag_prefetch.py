@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+from bm25_index import tokenize
+from rag_engine import _is_identifier_query
+
+
+class RAGPrefetcher:
+    """Runs RAGEngine.retrieve_context speculatively on text the user is still typing.
+
+    Only the most recent request is kept pending, so fast typing costs at most one retrieval in flight.
+    take() reuses a prefetched result for the same model and knowledge base version when the final prompt
+    matches a prefetched text exactly, or differs from it only in case, whitespace or punctuation (the same
+    sequence of search terms). Identifier queries such as "ERR-4411" only reuse exact matches. If a matching
+    prefetch is still running it waits for it instead of starting over.
+    """
+
+    def __init__(self, rag_engine, max_entries=8):
+        self.rag_engine = rag_engine
+        self.max_entries = max_entries
+        self._results = OrderedDict()  # (text, model, kb_version) -> (context, elapsed ms)
+        self._pending = None
+        self._running = None
+        self._cond = threading.Condition()
+        self._lookups = 0
+        self._exact_hits = 0
+        self._near_hits = 0
+        self._saved_ms = 0.0
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def prefetch(self, text, model):
+        with self._cond:
+            key = (text, model, self.rag_engine.kb_version)
+            if key in self._results or key == self._running:
+                return
+            self._pending = key
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                key, self._pending = self._pending, None
+                self._running = key
+            started = time.perf_counter()
+            try:
+                context = self.rag_engine.retrieve_context(key[0], model=key[1])
+            except Exception as e:
+                print(f"Error prefetching context: {e}")
+                context = None
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._cond:
+                self._running = None
+                if context is not None:
+                    self._results[key] = (context, elapsed_ms)
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+                self._cond.notify_all()
+
+    def _match(self, prompt, model, kb_version, keys):
+        # A draft paused mid-word ("ERR-44") or one digit off ("X200" for "X300") retrieves different
+        # chunks, so near matches must have exactly the same terms
+        terms = None if _is_identifier_query(prompt) else tuple(tokenize(prompt))
+        best = None
+        for key in keys:
+            if key is None or key[1] != model or key[2] != kb_version:
+                continue
+            if key[0] == prompt:
+                return key, True
+            if terms and tuple(tokenize(key[0])) == terms:
+                best = key
+        return best, False
+
+    def take(self, prompt, model, timeout=5.0):
+        """Returns the prefetched context for prompt, or None if nothing matches."""
+        kb_version = self.rag_engine.kb_version
+        waited_from = time.perf_counter()
+        with self._cond:
+            self._lookups += 1
+            key, exact = self._match(prompt, model, kb_version, list(self._results))
+            if key is None:
+                key, exact = self._match(prompt, model, kb_version, [self._running])
+                if key is not None:
+                    self._cond.wait_for(lambda: self._running != key, timeout)
+            if key is None or key not in self._results:
+                return None
+            context, elapsed_ms = self._results[key]
+            if exact:
+                self._exact_hits += 1
+            else:
+                self._near_hits += 1
+            self._saved_ms += max(0.0, elapsed_ms - (time.perf_counter() - waited_from) * 1000)
+            return list(context)
+
+    def stats(self):
+        with self._cond:
+            hits = self._exact_hits + self._near_hits
+            return {
+                "lookups": self._lookups,
+                "exact_hits": self._exact_hits,
+                "near_hits": self._near_hits,
+                "hit_rate": round(hits / self._lookups, 3) if self._lookups else 0.0,
+                "saved_ms": round(self._saved_ms, 1),
+            }
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def response_key(model, messages, options=None):
+    """Hash of everything that determines a reply: model, options and the fully assembled messages."""
+    payload = json.dumps({"model": model, "options": options or {}, "messages": messages},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def replay_chunks(model, text):
+    """Yields a cached reply as chat stream chunks, one word at a time, ending with a done chunk."""
+    for piece in re.findall(r"\s*\S+\s*", text) or [text]:
+        yield {"model": model, "message": {"role": "assistant", "content": piece}, "done": False}
+    yield {"model": model, "message": {"role": "assistant", "content": ""}, "done": True}
+
+
+class ResponseCache:
+    """Persistent cache of complete chat replies keyed on response_key(), with LRU and TTL eviction."""
+
+    def __init__(self, path, max_entries=5000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, content TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, content):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
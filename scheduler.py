@@ -0,0 +1,134 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# In-flight generations allowed per model; Ollama serves one request per loaded model at a time by default
+MODEL_CONCURRENCY = {}
+DEFAULT_MODEL_CONCURRENCY = 1
+
+
+class _Job:
+    def __init__(self, fn, model, priority, session_id, seq):
+        self.fn = fn
+        self.model = model
+        self.priority = priority
+        self.session_id = session_id
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+
+class GenerationScheduler:
+    """Runs model calls on a small pool of worker threads, lowest priority value first (FIFO within a
+    priority), with at most MODEL_CONCURRENCY[model] calls in flight per model.
+
+    is_stale(session_id) is checked when a job reaches the front of the queue; jobs for sessions it reports
+    as stale are dropped and their futures cancelled.
+    """
+
+    def __init__(self, workers=4, model_concurrency=None, is_stale=None):
+        self.model_concurrency = dict(MODEL_CONCURRENCY, **(model_concurrency or {}))
+        self.is_stale = is_stale
+        self._queue = []
+        self._running = {}  # model -> in-flight calls
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._completed = 0
+        self._dropped = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._started = 0
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, fn, model, priority=PRIORITY_INTERACTIVE, session_id=None):
+        """Queues fn() to run when a slot for model is free. Returns a concurrent.futures.Future."""
+        job = _Job(fn, model, priority, session_id, next(self._seq))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            self._queue.append(job)
+            self._cond.notify_all()
+        return job.future
+
+    def _limit(self, model):
+        return self.model_concurrency.get((model or "").split(":", 1)[0], DEFAULT_MODEL_CONCURRENCY)
+
+    def _next_job(self):
+        """Pops the best job whose model has a free slot, dropping stale ones on the way. Caller holds _cond."""
+        for job in sorted(self._queue, key=lambda j: (j.priority, j.seq)):
+            if job.session_id is not None and self.is_stale and self.is_stale(job.session_id):
+                self._queue.remove(job)
+                job.future.cancel()
+                self._dropped += 1
+                continue
+            if self._running.get(job.model, 0) < self._limit(job.model):
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+                self._running[job.model] = self._running.get(job.model, 0) + 1
+                wait = time.monotonic() - job.enqueued_at
+                self._started += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+            ran = job.future.set_running_or_notify_cancel()
+            failed = False
+            if ran:
+                try:
+                    job.future.set_result(job.fn())
+                except Exception as e:
+                    job.future.set_exception(e)
+                    failed = True
+
+            with self._cond:
+                self._running[job.model] -= 1
+                if not ran:
+                    self._dropped += 1
+                elif failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+                self._cond.notify_all()
+
+    def stats(self):
+        """Queue depth per priority, in-flight calls per model and queue wait times."""
+        with self._cond:
+            depth = {}
+            for job in self._queue:
+                depth[job.priority] = depth.get(job.priority, 0) + 1
+            return {
+                "queued": len(self._queue),
+                "queued_by_priority": depth,
+                "running": {model: n for model, n in self._running.items() if n},
+                "completed": self._completed,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "avg_wait_ms": round(1000 * self._wait_total / self._started, 1) if self._started else 0.0,
+                "max_wait_ms": round(1000 * self._wait_max, 1),
+            }
+
+    def shutdown(self):
+        """Cancels queued jobs; running ones finish in the background."""
+        with self._cond:
+            self._closed = True
+            for job in self._queue:
+                job.future.cancel()
+            self._queue = []
+            self._cond.notify_all()
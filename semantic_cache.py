@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """Persistent cache of RAG answers looked up by question similarity.
+
+    An entry is reusable for a new question when it was produced by the same model against the same
+    knowledge base version and the two question embeddings have cosine similarity >= threshold. Entries for
+    older knowledge base versions are deleted by invalidate(). Per (model, KB version) the normalised question
+    embeddings are kept in memory as one matrix, so a lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, path, threshold=0.92, max_entries=2000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrices = {}  # (model, kb_version) -> (entry ids, normalised embeddings)
+        parent = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, model TEXT NOT NULL, kb_version INTEGER NOT NULL, question TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, answer TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers (model, kb_version)")
+        self._conn.commit()
+
+    @staticmethod
+    def _normalise(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, model, kb_version):
+        key = (model, kb_version)
+        if key not in self._matrices:
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM answers WHERE model = ? AND kb_version = ?", key
+            ).fetchall()
+            ids = [row[0] for row in rows]
+            matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+            self._matrices[key] = (ids, matrix)
+        return self._matrices[key]
+
+    def lookup(self, embedding, model, kb_version):
+        """Returns {"question", "answer", "similarity"} for the closest stored question, or None."""
+        query = self._normalise(embedding)
+        with self._lock:
+            ids, matrix = self._matrix(model, kb_version)
+            if matrix is None or matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            question, answer = self._conn.execute(
+                "SELECT question, answer FROM answers WHERE id = ?", (ids[best],)
+            ).fetchone()
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), ids[best]))
+            self._conn.commit()
+            self.hits += 1
+        return {"question": question, "answer": answer, "similarity": float(scores[best])}
+
+    def store(self, question, embedding, answer, model, kb_version):
+        vector = self._normalise(embedding)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (model, kb_version, question, embedding, answer, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (model, kb_version, question, vector.tobytes(), answer, time.time()),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self._matrices.clear()
+            else:
+                self._matrices.pop((model, kb_version), None)
+            self._conn.commit()
+
+    def invalidate(self, kb_version):
+        """Drops every answer produced against a knowledge base version other than kb_version."""
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE kb_version != ?", (kb_version,))
+            self._conn.commit()
+            self._matrices.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,121 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+
+class SessionArchive:
+    """Cold storage for chat sessions: one gzip member per session appended to a single pack file,
+    with a SQLite index of (offset, length, mtime) so listing never touches the pack.
+
+    Removed or replaced sessions leave dead bytes behind; the pack is rewritten once they outweigh
+    the live ones.
+    """
+
+    def __init__(self, directory, name="archive", compact_min_bytes=1024 * 1024):
+        self.directory = directory
+        self.name = name
+        self.compact_min_bytes = compact_min_bytes
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(directory, f"{name}_index.sqlite3"), check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS archived ("
+            "id TEXT PRIMARY KEY, offset INTEGER NOT NULL, length INTEGER NOT NULL, mtime REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        self._conn.commit()
+        generation = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        self._generation = int(generation[0]) if generation else 0
+
+    @property
+    def pack_path(self):
+        # Compaction writes a new generation and switches to it in the index, so a crash mid-rewrite
+        # leaves the old pack and offsets intact
+        return os.path.join(self.directory, f"{self.name}.{self._generation}.pack")
+
+    def __contains__(self, session_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM archived WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def add(self, session_id, messages, mtime):
+        data = gzip.compress(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            with open(self.pack_path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._drop(session_id)
+            self._conn.execute(
+                "INSERT INTO archived (id, offset, length, mtime) VALUES (?, ?, ?, ?)",
+                (session_id, offset, len(data), mtime),
+            )
+            self._conn.commit()
+
+    def read(self, session_id):
+        """Returns the archived messages, or None if the session is not archived."""
+        with self._lock:
+            row = self._conn.execute("SELECT offset, length FROM archived WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            with open(self.pack_path, "rb") as f:
+                f.seek(row[0])
+                data = f.read(row[1])
+        return json.loads(gzip.decompress(data).decode("utf-8"))
+
+    def list(self):
+        """Returns [{"id", "time"}] for every archived session."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, mtime FROM archived").fetchall()
+        return [{"id": session_id, "time": mtime} for session_id, mtime in rows]
+
+    def remove(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+            self._conn.commit()
+            self._maybe_compact()
+
+    def rename(self, old_id, new_id):
+        with self._lock:
+            self._drop(new_id)
+            self._conn.execute("UPDATE archived SET id = ? WHERE id = ?", (new_id, old_id))
+            self._conn.commit()
+
+    def _drop(self, session_id):
+        row = self._conn.execute("SELECT length FROM archived WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM archived WHERE id = ?", (session_id,))
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('dead_bytes', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+            (row[0],),
+        )
+
+    def _maybe_compact(self):
+        dead = self._conn.execute("SELECT value FROM meta WHERE key = 'dead_bytes'").fetchone()
+        dead = int(dead[0]) if dead else 0
+        live = self._conn.execute("SELECT COALESCE(SUM(length), 0) FROM archived").fetchone()[0]
+        if dead > self.compact_min_bytes and dead > live:
+            self._compact()
+
+    def _compact(self):
+        """Rewrites the live members into the next pack generation."""
+        rows = self._conn.execute("SELECT id, offset, length FROM archived ORDER BY offset").fetchall()
+        old_path = self.pack_path
+        new_path = os.path.join(self.directory, f"{self.name}.{self._generation + 1}.pack")
+        offsets = []
+        with open(old_path, "rb") as src, open(new_path, "wb") as dst:
+            for session_id, offset, length in rows:
+                src.seek(offset)
+                offsets.append((dst.tell(), session_id))
+                dst.write(src.read(length))
+            dst.flush()
+            os.fsync(dst.fileno())
+        with self._conn:
+            self._conn.executemany("UPDATE archived SET offset = ? WHERE id = ?", offsets)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dead_bytes', '0')")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)",
+                               (str(self._generation + 1),))
+        self._generation += 1
+        os.remove(old_path)
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Hashes a file in fixed-size blocks so large uploads are never read into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SourceManifest:
+    """Tracks what was ingested into the knowledge base: per-source content hash, mtime and chunk ids."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        parent = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "source TEXT PRIMARY KEY, content_hash TEXT NOT NULL, mtime REAL NOT NULL, "
+            "size INTEGER NOT NULL, chunk_count INTEGER NOT NULL, ingested_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+        )
+        self._conn.commit()
+
+    def get(self, source):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash, mtime, size, chunk_count FROM sources WHERE source = ?", (source,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"content_hash": row[0], "mtime": row[1], "size": row[2], "chunk_count": row[3]}
+
+    def record(self, source, content_hash, mtime, size, chunk_ids):
+        """Stores a freshly ingested source, replacing any previous entry for it."""
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (source, content_hash, mtime, size, chunk_count, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (source, content_hash, mtime, size, len(chunk_ids), time.time()),
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, source) VALUES (?, ?)",
+                                   [(chunk_id, source) for chunk_id in chunk_ids])
+            self._conn.commit()
+
+    def touch(self, source, mtime, size):
+        """Updates the stat info of a source whose content did not change."""
+        with self._lock:
+            self._conn.execute("UPDATE sources SET mtime = ?, size = ? WHERE source = ?", (mtime, size, source))
+            self._conn.commit()
+
+    def list_sources(self):
+        """Returns {source: chunk_count} without touching the vector store."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT source, chunk_count FROM sources ORDER BY source"))
+
+    def backfill(self, chunk_sources):
+        """Indexes an existing vector store from (chunk_id, source) pairs. Unknown hashes force a re-ingest on next upload."""
+        by_source = {}
+        for chunk_id, source in chunk_sources:
+            by_source.setdefault(source, []).append(chunk_id)
+        for source, ids in by_source.items():
+            self.record(source, "", 0, -1, ids)
+        self.set_meta("backfilled", "1")
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            self._conn.commit()
+
+    def chunk_ids(self, source):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks WHERE source = ?", (source,))]
+
+    def remove(self, source):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM sources")
+            self._conn.commit()
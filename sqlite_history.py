@@ -0,0 +1,261 @@
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+from history_manager import HistoryManager
+from history_search import HistorySearchIndex
+from session_archive import SessionArchive
+
+class SQLiteHistoryManager(HistoryManager):
+    """HistoryManager backed by a single SQLite file in WAL mode.
+
+    Sessions and messages live in separate tables with an index on last-modified time, so listing is a
+    paginated index scan and renames are a single transaction. Like the journal storage, saves only
+    insert messages beyond those already stored. Archived sessions keep their `sessions` row, so they are
+    still listed, while their messages move to one zlib-compressed blob in `archived`.
+    """
+
+    def __init__(self, history_dir="chat_history", db_name="history.sqlite3", search=True,
+                 write_behind=False, flush_interval=1.0, archive_after=None):
+        if not os.path.exists(history_dir):
+            os.makedirs(history_dir)
+        self.db_path = os.path.join(history_dir, db_name)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # Only takes effect on a new database; older ones are converted below when archiving is enabled
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at DESC);"
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (session_id, position));"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS archived (session_id TEXT PRIMARY KEY, data BLOB NOT NULL);"
+        )
+        self._conn.commit()
+        if archive_after is not None:
+            self._convert_to_incremental_vacuum()
+        super().__init__(history_dir, search=search, write_behind=write_behind, flush_interval=flush_interval,
+                         archive_after=archive_after)
+
+    def _open_archive(self):
+        # Archived sessions are stored in this database rather than a separate pack file
+        return None
+
+    def _archive_candidates(self, cutoff):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, updated_at FROM sessions WHERE updated_at < ? "
+                "AND id NOT IN (SELECT session_id FROM archived)",
+                (cutoff,),
+            ).fetchall()
+
+    def _archive_session(self, session_id, mtime):
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY position", (session_id,)
+            ).fetchall()
+            data = zlib.compress(("[" + ",".join(row[0] for row in rows) + "]").encode("utf-8"))
+            self._conn.execute("INSERT INTO archived (session_id, data) VALUES (?, ?)", (session_id, data))
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+
+    def archive_old_sessions(self, max_age=None):
+        archived = super().archive_old_sessions(max_age)
+        if archived:
+            self._release_free_pages()
+        return archived
+
+    def _release_free_pages(self, step_pages=256):
+        """Gives pages freed by archiving back to the filesystem. Pages are released a step at a time, so
+        saves and listings from other threads wait for one short step rather than a whole VACUUM."""
+        with self._lock:
+            if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # Not converted (archiving was not enabled at startup); SQLite reuses the free pages instead
+                return
+        while True:
+            with self._lock:
+                if not self._conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                    break
+                # The pragma frees one page per step, so the cursor has to be drained
+                self._conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _convert_to_incremental_vacuum(self):
+        """One full VACUUM for databases created before incremental vacuum was enabled. It runs in the
+        constructor, before the writer and archiving threads start and before a front end can save, so it
+        delays the first startup after upgrading instead of blocking or failing saves."""
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        try:
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"Error compacting history database: {e}")
+
+    def _read_archived(self, session_id):
+        row = self._conn.execute("SELECT data FROM archived WHERE session_id = ?", (session_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")) if row else None
+
+    def _restore_archived(self, session_id):
+        messages = self._read_archived(session_id)
+        if messages is None:
+            return
+        self._conn.execute("DELETE FROM archived WHERE session_id = ?", (session_id,))
+        self._conn.executemany(
+            "INSERT INTO messages (session_id, position, role, content, data) VALUES (?, ?, ?, ?, ?)",
+            [
+                (session_id, position, m.get("role", ""), m.get("content", ""), json.dumps(m, ensure_ascii=False))
+                for position, m in enumerate(messages)
+            ],
+        )
+
+    def _open_search_index(self):
+        # The FTS tables live in the same database file as the messages
+        return HistorySearchIndex(self._conn, self._lock)
+
+    def _write_session(self, session_id, messages, start=0, updated_at=None):
+        now = updated_at or time.time()
+        end = start + len(messages)
+        with self._lock, self._conn:
+            self._restore_archived(session_id)
+            stored = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            if end < stored:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND position >= ?", (session_id, end)
+                )
+                stored = end
+            first = max(stored, start)
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, position, role, content, data) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (session_id, position, m.get("role", ""), m.get("content", ""), json.dumps(m, ensure_ascii=False))
+                    for position, m in enumerate(messages[first - start:], start=first)
+                ],
+            )
+            self._conn.execute(
+                "INSERT INTO sessions (id, created_at, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at",
+                (session_id, now, now),
+            )
+
+    def _read_session(self, session_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? ORDER BY position", (session_id,)
+            ).fetchall()
+            if not rows:
+                return self._read_archived(session_id) or []
+        return [json.loads(row[0]) for row in rows]
+
+    def _read_session_window(self, session_id, limit, before):
+        with self._lock:
+            archived = self._read_archived(session_id)
+            if archived is not None:
+                end = len(archived) if before is None else min(before, len(archived))
+                start = max(0, end - limit)
+                return archived[start:end], start
+            if before is None:
+                before = self._conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+            start = max(0, before - limit)
+            rows = self._conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? AND position >= ? AND position < ? ORDER BY position",
+                (session_id, start, before),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows], start
+
+    def load_latest_summary(self, session_id):
+        if session_id in self._pending:
+            return super().load_latest_summary(session_id)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM messages WHERE session_id = ? AND role = 'system' "
+                "AND json_extract(data, '$.summary') ORDER BY position DESC LIMIT 1",
+                (session_id,),
+            ).fetchone()
+            if row is None and self._read_archived(session_id) is not None:
+                return super().load_latest_summary(session_id)
+        return json.loads(row[0]) if row else None
+
+    def _list_sessions(self, limit, offset):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, updated_at FROM sessions ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        return [{"id": session_id, "time": updated_at} for session_id, updated_at in rows]
+
+    def _delete_session(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM archived WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def _rename_session(self, old_id, new_id):
+        with self._lock, self._conn:
+            if self._conn.execute("SELECT 1 FROM sessions WHERE id = ?", (old_id,)).fetchone() is None:
+                return
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (new_id,))
+            self._conn.execute("DELETE FROM archived WHERE session_id = ?", (new_id,))
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (new_id,))
+            self._conn.execute("UPDATE sessions SET id = ? WHERE id = ?", (new_id, old_id))
+            self._conn.execute("UPDATE messages SET session_id = ? WHERE session_id = ?", (new_id, old_id))
+            self._conn.execute("UPDATE archived SET session_id = ? WHERE session_id = ?", (new_id, old_id))
+
+    def import_json_sessions(self, source_dir=None):
+        """One-shot migration of chat_history/*.json and *.jsonl files. Returns the number of sessions imported.
+        The files are read directly, so no file-based history manager (or its archive index) is created."""
+        with self._lock:
+            if self._conn.execute("SELECT value FROM meta WHERE key = 'json_imported'").fetchone():
+                return 0
+        source_dir = source_dir or self.history_dir
+        imported = 0
+        for session_id, updated_at, read in self._json_session_sources(source_dir):
+            with self._lock:
+                exists = self._conn.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if exists:
+                continue
+            messages = read()
+            self._write_session(session_id, messages, updated_at=updated_at)
+            self._index_session(session_id, messages)
+            imported += 1
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', ?)", (str(imported),))
+        return imported
+
+    def _json_session_sources(self, source_dir):
+        """Yields (session id, modified time, read()) for each file-based session; a journal wins over a JSON
+        file of the same session, as in HistoryManager. Sessions in an existing pack archive are included."""
+        paths = {}
+        for name in os.listdir(source_dir):
+            session_id, ext = os.path.splitext(name)
+            if ext == ".jsonl" or (ext == ".json" and session_id not in paths):
+                paths[session_id] = os.path.join(source_dir, name)
+        for session_id, path in paths.items():
+            if path.endswith(".jsonl"):
+                yield session_id, os.path.getmtime(path), lambda p=path: self._replay_journal(p)[0]
+            else:
+                yield session_id, os.path.getmtime(path), lambda p=path: self._read_json(p)
+        if os.path.exists(os.path.join(source_dir, "archive_index.sqlite3")):
+            archive = SessionArchive(source_dir)
+            for session in archive.list():
+                if session["id"] not in paths:
+                    yield session["id"], session["time"], lambda s_id=session["id"]: archive.read(s_id) or []
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+if __name__ == "__main__":
+    print(f"Imported {SQLiteHistoryManager().import_json_sessions()} sessions into chat_history/history.sqlite3")
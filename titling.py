@@ -0,0 +1,118 @@
+import threading
+import time
+
+import ollama
+
+import ollama_client
+
+# Small model used for titles (ollama pull llama3.2:1b); cheaper than the chat presets and loaded
+# separately, so titling does not wait for a reply's model slot
+TITLE_MODEL = "llama3.2:1b"
+# Used instead when TITLE_MODEL has not been pulled
+TITLE_FALLBACK_MODEL = "llama3.2"
+TITLE_PROMPT = ("Generate a short 3-5 word title for this chat. "
+                "Return ONLY the title string, no quotes or extra text.")
+# Characters of each message of the first exchange sent to the title model
+TITLE_INPUT_CHARS = 1000
+TITLE_MAX_TOKENS = 16
+VALID_TITLE_CHARS = "-_.() abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def is_untitled(session_id):
+    """Titled sessions are renamed to "<timestamp id> - <title>"."""
+    return " - " not in session_id
+
+
+class TitleService:
+    """Titles chat sessions from their first exchange with a small model.
+
+    run_batch() titles untitled sessions that have been idle for min_age seconds; start() runs batches in
+    a background thread. Renames go through HistoryManager.rename_session and are remembered, so a front end
+    still holding an old id can look up the new one with resolve().
+    """
+
+    def __init__(self, history_mgr, model=TITLE_MODEL, batch_size=5, min_age=120):
+        self.history_mgr = history_mgr
+        self.model = model
+        self.batch_size = batch_size
+        self.min_age = min_age
+        self._renamed = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def make_title(self, messages):
+        """Returns a filename-safe title for a conversation's first exchange, or None."""
+        exchange = [m for m in messages if not m.get("summary")][:2]
+        if not exchange:
+            return None
+        msgs = [{"role": m["role"], "content": m.get("content", "")[:TITLE_INPUT_CHARS]} for m in exchange]
+        msgs.append({"role": "user", "content": TITLE_PROMPT})
+        options = {"temperature": 0, "num_predict": TITLE_MAX_TOKENS}
+        try:
+            response = ollama_client.chat(self.model, msgs, options=options, cache=True)
+        except ollama.ResponseError as e:
+            if e.status_code != 404 or self.model == TITLE_FALLBACK_MODEL:
+                raise
+            print(f"Title model {self.model} not found, using {TITLE_FALLBACK_MODEL}")
+            self.model = TITLE_FALLBACK_MODEL
+            response = ollama_client.chat(self.model, msgs, options=options, cache=True)
+        title = response["message"]["content"].strip().split("\n")[0].strip(' "\'')
+        return "".join(c for c in title if c in VALID_TITLE_CHARS).strip()[:40] or None
+
+    def title_session(self, session_id):
+        """Titles one session from its first exchange. Returns the new session id, or None."""
+        first, _ = self.history_mgr.load_session_window(session_id, limit=4, before=4)
+        if not any(m.get("role") == "assistant" for m in first):
+            return None
+        title = self.make_title(first)
+        if not title:
+            return None
+        new_id = f"{session_id} - {title}"
+        self.history_mgr.rename_session(session_id, new_id)
+        with self._lock:
+            self._renamed[session_id] = new_id
+        return new_id
+
+    def resolve(self, session_id):
+        """The current id of a session that may have been renamed by this service."""
+        with self._lock:
+            return self._renamed.get(session_id, session_id)
+
+    def run_batch(self, exclude=(), scan=200):
+        """Titles up to batch_size untitled sessions among the scan most recent, skipping those in exclude
+        and those modified in the last min_age seconds. Returns {old id: new id}."""
+        cutoff = time.time() - self.min_age
+        renamed = {}
+        for session in self.history_mgr.list_sessions(limit=scan):
+            if len(renamed) >= self.batch_size or self._stop.is_set():
+                break
+            session_id = session["id"]
+            if not is_untitled(session_id) or session_id in exclude or session["time"] > cutoff:
+                continue
+            try:
+                new_id = self.title_session(session_id)
+            except Exception as e:
+                print(f"Error titling session {session_id}: {e}")
+                continue
+            if new_id:
+                renamed[session_id] = new_id
+        return renamed
+
+    def start(self, interval=60, is_idle=None, exclude=None):
+        """Runs a batch every interval seconds when is_idle() (if given) is true. exclude() returns the
+        session ids to leave alone, e.g. the one open in the UI. Returns the thread."""
+        def _loop():
+            while not self._stop.wait(interval):
+                if is_idle and not is_idle():
+                    continue
+                try:
+                    self.run_batch(exclude() if exclude else ())
+                except Exception as e:
+                    print(f"Error titling sessions: {e}")
+
+        thread = threading.Thread(target=_loop, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
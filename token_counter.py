@@ -0,0 +1,43 @@
+import math
+
+# Approximate characters per token for the models we ship presets for. Ollama does not expose its
+# tokenizers, and for budgeting prompts a per-model ratio is close enough without an extra dependency.
+CHARS_PER_TOKEN = {
+    "mistral": 3.6,
+    "llama3.2": 4.0,
+    "nomic-embed-text": 4.0,
+}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# Tokens of knowledge base context to pack into a RAG prompt, per model. About three 1000-character
+# chunks, so prompts are no larger than with plain top-3 retrieval
+CONTEXT_TOKEN_BUDGETS = {
+    "mistral": 850,
+    "llama3.2": 800,
+}
+DEFAULT_CONTEXT_TOKEN_BUDGET = 800
+
+# Tokens of recent conversation to send with each turn, per model; older turns are summarised
+HISTORY_TOKEN_BUDGETS = {
+    "mistral": 2500,
+    "llama3.2": 3000,
+}
+DEFAULT_HISTORY_TOKEN_BUDGET = 2500
+
+
+def _base_model(model):
+    """"llama3.2:3b" -> "llama3.2"."""
+    return (model or "").split(":", 1)[0]
+
+
+def count_tokens(text, model=None):
+    ratio = CHARS_PER_TOKEN.get(_base_model(model), DEFAULT_CHARS_PER_TOKEN)
+    return math.ceil(len(text) / ratio)
+
+
+def context_token_budget(model=None):
+    return CONTEXT_TOKEN_BUDGETS.get(_base_model(model), DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def history_token_budget(model=None):
+    return HISTORY_TOKEN_BUDGETS.get(_base_model(model), DEFAULT_HISTORY_TOKEN_BUDGET)